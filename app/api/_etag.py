@@ -0,0 +1,28 @@
+# app/api/_etag.py
+from __future__ import annotations
+from typing import Optional
+
+from fastapi import Request, Response
+
+
+def _matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*":
+            return True
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag.strip('"') == etag:
+            return True
+    return False
+
+
+def not_modified(request: Request, etag: str) -> Optional[Response]:
+    """
+    Returns a bodyless 304 if the client's If-None-Match already covers `etag`, else None.
+    """
+    if _matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    return None
@@ -0,0 +1,32 @@
+# app/api/_orjson.py
+from __future__ import annotations
+from decimal import Decimal
+from typing import Any
+
+import orjson
+from fastapi import Response
+
+_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_NAIVE_UTC
+
+
+def _default(o: Any) -> Any:
+    # Numeric columns come back as Decimal; the API exposes them as JSON numbers
+    if isinstance(o, Decimal):
+        return float(o)
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    return orjson.dumps(content, default=_default, option=_OPTIONS)
+
+
+class ORJSONResponse(Response):
+    """
+    JSON response rendered with orjson.
+    UUID/datetime values are encoded natively (UTC as "+00:00", like isoformat()) and Decimal
+    as a number, so handlers can pass ORM values straight through. Anything else raises TypeError.
+    """
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -1,21 +1,47 @@
 # app/api/config.py
 from __future__ import annotations
+from dataclasses import replace
+from typing import Tuple, Union
 from uuid import UUID
-import hashlib, json
 
+import orjson
 from fastapi import APIRouter, Depends, Header, HTTPException, Request, Response, status
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.api._etag import not_modified
+from app.api._orjson import ORJSONResponse, dumps
+from app.core.cache import TTLCache
 from app.core.deps import get_db
-from app.persistence.repo import ConfigRepo
+from app.persistence.models import ConfigVersion
+from app.persistence.repo import ConfigRepo, ConfigSnapshot
 from app.schemas.validator import validate_config_or_400
 
-router = APIRouter(prefix="/config", tags=["Config"])
+router = APIRouter(prefix="/config", tags=["Config"], default_response_class=ORJSONResponse)
 
-def _etag_of_json(j: dict) -> str:
-    # stable ETag of the inner JSON document
-    payload = json.dumps(j, sort_keys=True, separators=(",", ":")).encode("utf-8")
-    return hashlib.sha256(payload).hexdigest()
+# Rendered GET bodies keyed by version id -> (project_id, etag, body).
+# Config versions are immutable, so entries never go stale; the LRU just bounds memory.
+_BODIES: TTLCache[Tuple[str, str, bytes]] = TTLCache(maxsize=512, ttl=86400.0)
+
+
+def _rendered(row: Union[ConfigVersion, ConfigSnapshot]) -> Tuple[str, str, bytes]:
+    hit = _BODIES.get(row.id)
+    if hit is None:
+        body = dumps({
+            "id": row.id,
+            "projectId": row.project_id,
+            "versionLabel": row.version_label,
+            "json": row.json,
+        })
+        hit = (row.project_id, row.etag, body)
+        _BODIES.set(row.id, hit)
+    return hit
+
+
+def _respond(request: Request, etag: str, body: bytes) -> Response:
+    cached = not_modified(request, etag)
+    if cached is not None:
+        return cached
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})
 
 @router.post("", status_code=status.HTTP_201_CREATED)
 async def publish_config(
@@ -30,7 +56,12 @@ async def publish_config(
         "json": { ... actual billing config ... }
       }
     """
-    wrapper = await request.json()
+    try:
+        wrapper = orjson.loads(await request.body())
+    except orjson.JSONDecodeError:
+        raise HTTPException(status_code=400, detail={"type": "validation_error", "message": "Request body must be valid JSON"})
+    if not isinstance(wrapper, dict):
+        raise HTTPException(status_code=400, detail={"type": "validation_error", "message": "Request body must be a JSON object"})
     version_label = wrapper.get("versionLabel")
     cfg = wrapper.get("json")
 
@@ -54,22 +85,23 @@ async def publish_config(
 
     row = await repo.create(project_id=project_id, version_label=version_label, json_data=cfg)
     await db.commit()
+    ConfigRepo.invalidate_latest(project_id)
 
-    etag = _etag_of_json(cfg)
-    return Response(
-        content=json.dumps({
-            "id": str(row.id),
+    etag = row.etag
+    return ORJSONResponse(
+        content={
+            "id": row.id,
             "projectId": row.project_id,
             "versionLabel": row.version_label,
             "json": row.json,
-        }),
-        media_type="application/json",
+        },
         headers={"ETag": etag},
         status_code=status.HTTP_201_CREATED,
     )
 
 @router.get("/latest")
 async def get_latest_config(
+    request: Request,
     db: AsyncSession = Depends(get_db),
     project_id: str = Header(..., alias="X-Project-Id"),
 ):
@@ -78,37 +110,30 @@ async def get_latest_config(
     if not row:
         raise HTTPException(status_code=404, detail={"type": "not_found", "message": "No config for project"})
 
-    etag = _etag_of_json(row.json or {})
-    return Response(
-        content=json.dumps({
-            "id": str(row.id),
-            "projectId": row.project_id,
-            "versionLabel": row.version_label,
-            "json": row.json,
-        }),
-        media_type="application/json",
-        headers={"ETag": etag},
-    )
+    if row.etag is None:
+        row = replace(row, etag=await repo.ensure_etag(row))
+        await db.commit()
+    _, etag, body = _rendered(row)
+    return _respond(request, etag, body)
 
 @router.get("/{version_id}")
 async def get_config_version(
     version_id: UUID,
+    request: Request,
     db: AsyncSession = Depends(get_db),
     project_id: str = Header(..., alias="X-Project-Id"),
 ):
+    hit = _BODIES.get(version_id)
+    if hit is not None and hit[0] == project_id:
+        return _respond(request, hit[1], hit[2])
+
     repo = ConfigRepo(db)
     row = await repo.get_by_id(version_id)
     if not row or row.project_id != project_id:
         raise HTTPException(status_code=404, detail={"type": "not_found", "message": "Config version not found"})
 
-    etag = _etag_of_json(row.json or {})
-    return Response(
-        content=json.dumps({
-            "id": str(row.id),
-            "projectId": row.project_id,
-            "versionLabel": row.version_label,
-            "json": row.json,
-        }),
-        media_type="application/json",
-        headers={"ETag": etag},
-    )
\ No newline at end of file
+    if row.etag is None:
+        await repo.ensure_etag(row)
+        await db.commit()
+    _, etag, body = _rendered(row)
+    return _respond(request, etag, body)
@@ -1,22 +1,46 @@
 from __future__ import annotations
-from typing import Dict, Any
+from typing import Dict, Any, Tuple
 from datetime import datetime, timezone
+import hashlib
 
-from fastapi import APIRouter, Depends, Header, HTTPException, Query, status
+import orjson
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, status
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.api._etag import not_modified
+from app.api._orjson import ORJSONResponse
 from app.core.deps import get_db
-from app.persistence.repo import EntitlementsRepo, SubscriptionRepo, ConfigRepo
+from app.engine.engine import EngineError, find_plan, parse_config
+from app.persistence.repo import ConfigSnapshot, EntitlementsRepo, SubscriptionRepo, ConfigRepo
 from app.schemas.api_models import EntitlementsCacheResponse
+from app.engine.strategies.base import StrategyBundle
 from app.engine.strategies.registry import build_bundle  # assuming this builds strategies
 
-router = APIRouter(prefix="/entitlements", tags=["Entitlements"])
+router = APIRouter(prefix="/entitlements", tags=["Entitlements"], default_response_class=ORJSONResponse)
 
-def _iso(dt) -> str:
-    return dt.astimezone(timezone.utc).isoformat()
+_UTC = timezone.utc
 
-@router.get("", response_model=EntitlementsCacheResponse)
+def _as_utc(dt: datetime) -> datetime:
+    # ORJSONResponse renders UTC datetimes as "...+00:00"; only convert when the driver returned another offset
+    if dt.tzinfo is _UTC:
+        return dt
+    return dt.astimezone(_UTC)
+
+def _plan_and_bundle(project_id: str, cfg: ConfigSnapshot, plan_code: str, meta: Any) -> Tuple[dict, StrategyBundle]:
+    # same (code, cadence) choice as the engine; build_bundle is memoised by the registry
+    parsed = parse_config(project_id, cfg)
+    hint = meta.get("cadence") if isinstance(meta, dict) else None
+    plan = find_plan(parsed.plans_by_code, plan_code=plan_code, cadence_hint=hint if hint in ("monthly", "annual") else None)
+    return plan, build_bundle(plan)
+
+def _etag_of(payload: Dict[str, Any], as_of: datetime) -> str:
+    h = hashlib.sha256(orjson.dumps(payload, option=orjson.OPT_SORT_KEYS))
+    h.update(as_of.isoformat().encode())
+    return h.hexdigest()
+
+@router.get("", responses={200: {"model": EntitlementsCacheResponse}})
 async def get_entitlements(
+    request: Request,
     accountId: str = Query(..., min_length=1),
     db: AsyncSession = Depends(get_db),
     project_id: str = Header(..., alias="X-Project-Id"),
@@ -25,14 +49,22 @@ async def get_entitlements(
     row = await repo.get(project_id=project_id, account_id=accountId)
     if not row:
         raise HTTPException(status_code=404, detail={"type": "not_found", "message": "No cached entitlements"})
-    return EntitlementsCacheResponse(
-        projectId=project_id,
-        accountId=accountId,
-        asOf=_iso(row.as_of),
-        payload=row.payload,
+
+    etag = _etag_of(row.payload, row.as_of)
+    cached = not_modified(request, etag)
+    if cached is not None:
+        return cached
+    return ORJSONResponse(
+        content={
+            "projectId": project_id,
+            "accountId": accountId,
+            "asOf": _as_utc(row.as_of),
+            "payload": row.payload,
+        },
+        headers={"ETag": etag},
     )
 
-@router.post("/refresh", response_model=EntitlementsCacheResponse, status_code=status.HTTP_200_OK)
+@router.post("/refresh", responses={200: {"model": EntitlementsCacheResponse}}, status_code=status.HTTP_200_OK)
 async def refresh_entitlements(
     accountId: str = Query(..., min_length=1),
     db: AsyncSession = Depends(get_db),
@@ -52,17 +84,16 @@ async def refresh_entitlements(
     if not cfg or not isinstance(cfg.json, dict):
         raise HTTPException(status_code=400, detail={"type":"validation_error", "message":"Project config missing"})
 
-    # Find plan definition to feed strategy
-    plans = cfg.json.get("plans", [])
-    plan_def = next((p for p in plans if p.get("code") == sub.plan_code), None)
-    if not plan_def:
+    # Find plan definition (same code + cadence choice as the engine) and its strategy bundle
+    try:
+        plan_def, bundle = _plan_and_bundle(project_id, cfg, sub.plan_code, sub.meta)
+    except EngineError:
         raise HTTPException(status_code=400, detail={"type":"validation_error", "message":"Plan not found in config"})
 
-    # Build strategy bundle and resolve entitlements
-    bundle = build_bundle(plan_def)
+    # Resolve entitlements
     ent_payload = bundle.entitlement.resolve(plan_def, overrides=sub.meta or None)
 
-    now = datetime.now(tz=timezone.utc)
+    now = datetime.now(tz=_UTC)
     row = await EntitlementsRepo(db).upsert(
         project_id=project_id,
         account_id=accountId,
@@ -71,9 +102,11 @@ async def refresh_entitlements(
     )
     await db.commit()
 
-    return EntitlementsCacheResponse(
-        projectId=project_id,
-        accountId=accountId,
-        asOf=_iso(row.as_of),
-        payload=row.payload,
+    return ORJSONResponse(
+        content={
+            "projectId": project_id,
+            "accountId": accountId,
+            "asOf": _as_utc(row.as_of),
+            "payload": row.payload,
+        }
     )
\ No newline at end of file
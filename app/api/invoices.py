@@ -1,51 +1,67 @@
 from __future__ import annotations
-from typing import List, Optional
+from typing import List
 from uuid import UUID
+import operator
 
 from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.core.deps import get_db
+from app.api._orjson import ORJSONResponse, dumps
+from app.core.deps import get_db, SessionLocal
 from app.persistence.repo import InvoiceRepo
 from app.persistence.models import Invoice, InvoiceLine
-from app.schemas.api_models import InvoiceListItem, InvoiceDetail, InvoiceLineItem
+from app.schemas.api_models import InvoiceListItem, InvoiceDetail
 
-router = APIRouter(prefix="/invoices", tags=["Invoices"])
+router = APIRouter(prefix="/invoices", tags=["Invoices"], default_response_class=ORJSONResponse)
 
-def _iso(dt) -> Optional[str]:
-    return dt.isoformat() if dt else None
+_INVOICE_FIELDS = (
+    ("id", "id"),
+    ("projectId", "project_id"),
+    ("stripeInvoiceId", "stripe_invoice_id"),
+    ("stripeCustomerId", "stripe_customer_id"),
+    ("stripeSubscriptionId", "stripe_subscription_id"),
+    ("status", "status"),
+    ("currency", "currency"),
+    ("subtotal", "subtotal"),
+    ("total", "total"),
+    ("hostedInvoiceUrl", "hosted_invoice_url"),
+    ("periodStart", "period_start"),
+    ("periodEnd", "period_end"),
+    ("createdAt", "created_at"),
+)
+_INVOICE_KEYS = tuple(k for k, _ in _INVOICE_FIELDS)
+_invoice_attrs = operator.attrgetter(*(a for _, a in _INVOICE_FIELDS))
 
-@router.get("", response_model=List[InvoiceListItem])
+def _fmt(i: Invoice) -> dict:
+    # Decimal/datetime/UUID/None are passed through as-is; the orjson renderer encodes them
+    return dict(zip(_INVOICE_KEYS, _invoice_attrs(i)))
+
+@router.get("", responses={200: {"model": List[InvoiceListItem]}})
 async def list_invoices(
     accountId: str = Query(..., min_length=1),
-    db: AsyncSession = Depends(get_db),
     project_id: str = Header(..., alias="X-Project-Id"),
     limit: int = Query(50, ge=1, le=200),
     offset: int = Query(0, ge=0),
 ):
-    items = await InvoiceRepo(db).list_for_account(
-        project_id=project_id, account_id=accountId, limit=limit, offset=offset
-    )
-    return [
-        InvoiceListItem(
-            id=i.id,
-            projectId=i.project_id,
-            stripeInvoiceId=i.stripe_invoice_id,
-            stripeCustomerId=i.stripe_customer_id,
-            stripeSubscriptionId=i.stripe_subscription_id,
-            status=i.status,
-            currency=i.currency,
-            subtotal=float(i.subtotal) if i.subtotal is not None else None,
-            total=float(i.total) if i.total is not None else None,
-            hostedInvoiceUrl=i.hosted_invoice_url,
-            periodStart=_iso(i.period_start),
-            periodEnd=_iso(i.period_end),
-            createdAt=_iso(i.created_at),
-        )
-        for i in items
-    ]
+    # The body is produced after the handler returns (when request-scoped deps are already closed),
+    # so the generator owns its session.
+    async def gen():
+        async with SessionLocal() as db:
+            yield b"["
+            first = True
+            async for i in InvoiceRepo(db).iter_for_account(
+                project_id=project_id, account_id=accountId, limit=limit, offset=offset
+            ):
+                if not first:
+                    yield b","
+                first = False
+                yield dumps(_fmt(i))
+            yield b"]"
 
-@router.get("/{invoice_id}", response_model=InvoiceDetail)
+    return StreamingResponse(gen(), media_type="application/json")
+
+@router.get("/{invoice_id}", responses={200: {"model": InvoiceDetail}})
 async def get_invoice(
     invoice_id: UUID,
     db: AsyncSession = Depends(get_db),
@@ -56,29 +72,16 @@ async def get_invoice(
     if not inv or inv.project_id != project_id:
         raise HTTPException(status_code=404, detail={"type": "not_found", "message": "Invoice not found"})
 
-    return InvoiceDetail(
-        id=inv.id,
-        projectId=inv.project_id,
-        stripeInvoiceId=inv.stripe_invoice_id,
-        stripeCustomerId=inv.stripe_customer_id,
-        stripeSubscriptionId=inv.stripe_subscription_id,
-        status=inv.status,
-        currency=inv.currency,
-        subtotal=float(inv.subtotal) if inv.subtotal is not None else None,
-        total=float(inv.total) if inv.total is not None else None,
-        hostedInvoiceUrl=inv.hosted_invoice_url,
-        periodStart=_iso(inv.period_start),
-        periodEnd=_iso(inv.period_end),
-        createdAt=_iso(inv.created_at),
-        lines=[
-            InvoiceLineItem(
-                id=l.id,
-                lineType=l.line_type,
-                featureKey=l.feature_key,
-                quantity=float(l.quantity),
-                unitPrice=float(l.unit_price),
-                amount=float(l.amount),
-            )
-            for l in lines
-        ],
-    )
\ No newline at end of file
+    detail = _fmt(inv)
+    detail["lines"] = [
+        {
+            "id": l.id,
+            "lineType": l.line_type,
+            "featureKey": l.feature_key,
+            "quantity": l.quantity,
+            "unitPrice": l.unit_price,
+            "amount": l.amount,
+        }
+        for l in lines
+    ]
+    return ORJSONResponse(content=detail)
@@ -1,42 +1,114 @@
 # app/api/stripe_webhooks.py
 from __future__ import annotations
 
-from typing import Optional, Any, Dict
-from datetime import datetime, timezone
+import asyncio
+from typing import Optional, Any, Dict, List
+from uuid import UUID
+from datetime import datetime, timedelta, timezone
 
-from fastapi import APIRouter, Request, Header, Depends, HTTPException
+import structlog
+from fastapi import APIRouter, BackgroundTasks, Request, Header, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.core.deps import get_db, get_stripe_provider
+from app.core.circuit import CircuitBreaker, CircuitOpenError
+from app.core.deps import get_db_txn, get_stripe_provider, SessionLocal
+from app.payments.stripe_provider import TRANSIENT_ERRORS
 from app.persistence.repo import EventRepo, SubscriptionRepo, InvoiceRepo
 
 router = APIRouter(prefix="/stripe", tags=["Stripe"])
+log = structlog.get_logger(__name__)
+
+# One breaker per Stripe endpoint: when Stripe is down, fail fast instead of holding a
+# DB session while requests time out. Before the ACK (project inference) that is a 503
+# and Stripe re-delivers; after it, the event stays unprocessed for the retry sweep.
+_SUBSCRIPTIONS_BREAKER = CircuitBreaker("stripe.subscriptions", trip_on=TRANSIENT_ERRORS)
+_CUSTOMERS_BREAKER = CircuitBreaker("stripe.customers", trip_on=TRANSIENT_ERRORS)
+# Bulkhead: at most this many Stripe retrieves in flight per worker; the rest queue here
+# instead of piling up threads (and held DB sessions) while Stripe is slow.
+_STRIPE_BULKHEAD = asyncio.Semaphore(32)
 
 
 # -------------------- helpers --------------------
 
+_UTC = timezone.utc
+
+
 def _utc_from_epoch(ts: Optional[int]) -> Optional[datetime]:
     if ts is None:
         return None
-    return datetime.fromtimestamp(int(ts), tz=timezone.utc)
+    return datetime.fromtimestamp(int(ts), tz=_UTC)
+
+
+def _sub_state(remote: Dict[str, Any]) -> Dict[str, Any]:
+    """update_from_stripe kwargs for a Stripe subscription dict."""
+    return {
+        "status": remote.get("status"),
+        "current_period_start": _utc_from_epoch(remote.get("current_period_start")),
+        "current_period_end": _utc_from_epoch(remote.get("current_period_end")),
+        "trial_end_at": _utc_from_epoch(remote.get("trial_end")),
+        "cancel_at_period_end": bool(remote.get("cancel_at_period_end", False)),
+    }
 
 
 def _to_dict(obj: Any) -> Dict[str, Any]:
     """
     Normalize Stripe SDK objects (have .to_dict_recursive()) and plain dicts to a plain dict.
     """
+    # plain dicts (parsed payloads, fake provider) are the common case
+    if obj.__class__ is dict:
+        return obj
     if obj is None:
         return {}
-    if isinstance(obj, dict):
-        return obj
     # Stripe.py resources expose to_dict_recursive()
     to_dict = getattr(obj, "to_dict_recursive", None)
-    if callable(to_dict):
+    if to_dict is not None:
         return to_dict()
     # Fallback best-effort
     return dict(obj)
 
 
+# local statuses an invoice event leaves unchanged when the period also matches
+_INVOICE_SETTLED_STATUSES = {
+    "invoice.payment_succeeded": ("active", "trialing"),
+    "invoice.payment_failed": ("past_due", "unpaid"),
+}
+
+
+def _invoice_confirms_local(event_type: str, inv: Dict[str, Any], local) -> bool:
+    """
+    True when the invoice payload already agrees with the local subscription
+    (status + subscription line period), so re-fetching it from Stripe is redundant.
+    """
+    if local.status not in _INVOICE_SETTLED_STATUSES.get(event_type, ()):
+        return False
+    lines = (_to_dict(inv.get("lines") or {}).get("data") or [])
+    period = _to_dict(lines[0].get("period") or {}) if lines else {}
+    period_end = _utc_from_epoch(period.get("end"))
+    return period_end is not None and period_end == local.current_period_end
+
+
+# Stripe events are tens of KB at most; anything far larger is not a real delivery
+_MAX_WEBHOOK_BYTES = 1 << 20
+
+
+async def _read_body_capped(request: Request, limit: int) -> bytes:
+    """
+    Read the request body, failing fast with 413 once it exceeds `limit`
+    (declared Content-Length first, then actual bytes while streaming).
+    """
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > limit:
+        raise HTTPException(status_code=413, detail="Webhook payload too large")
+    chunks = []
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > limit:
+            raise HTTPException(status_code=413, detail="Webhook payload too large")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
 def _require(md: Dict[str, Any], key: str) -> Optional[str]:
     v = None
     if isinstance(md, dict):
@@ -44,22 +116,66 @@ def _require(md: Dict[str, Any], key: str) -> Optional[str]:
     return v
 
 
+def _release_bulkhead(fut: asyncio.Future) -> None:
+    _STRIPE_BULKHEAD.release()
+    if not fut.cancelled():
+        fut.exception()  # mark retrieved: the caller may have been cancelled and gone
+
+
+async def _in_bulkhead(fn, *args):
+    """
+    Run a blocking Stripe call in a thread under _STRIPE_BULKHEAD. A thread cannot be
+    stopped, so the slot is held until it finishes even if the caller is cancelled first.
+    """
+    await _STRIPE_BULKHEAD.acquire()
+    fut = asyncio.ensure_future(asyncio.to_thread(fn, *args))
+    fut.add_done_callback(_release_bulkhead)
+    return await asyncio.shield(fut)
+
+
+class _StripeLookups:
+    """
+    Per-request memo of Stripe reads: project inference and the handlers share
+    one retrieve per subscription/customer id. Calls run off the event loop.
+    """
+
+    def __init__(self, provider):
+        self.provider = provider
+        self._subs: Dict[str, Dict[str, Any]] = {}
+        self._customers: Dict[str, Dict[str, Any]] = {}
+
+    async def subscription(self, sub_id: str) -> Dict[str, Any]:
+        if sub_id not in self._subs:
+            async with _SUBSCRIPTIONS_BREAKER:
+                remote = await _in_bulkhead(self.provider.retrieve_subscription, sub_id)
+            self._subs[sub_id] = _to_dict(remote)
+        return self._subs[sub_id]
+
+    async def customer(self, cus_id: str) -> Dict[str, Any]:
+        if cus_id not in self._customers:
+            async with _CUSTOMERS_BREAKER:
+                remote = await _in_bulkhead(self.provider.retrieve_customer, cus_id)
+            self._customers[cus_id] = _to_dict(remote)
+        return self._customers[cus_id]
+
+
 # -------------------- webhook --------------------
 
 @router.post("/webhook")
 async def webhook(
     request: Request,
+    background_tasks: BackgroundTasks,
     stripe_signature: str = Header(None, alias="Stripe-Signature"),
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_db_txn),
     provider = Depends(get_stripe_provider),
 ):
     """
-    Handles key events and syncs local DB:
+    Verifies and records the event, then syncs local DB in the background:
       - checkout.session.completed -> attach Stripe subscription ID to our local subscription
       - invoice.payment_succeeded / invoice.payment_failed -> mirror invoice and refresh local sub
       - customer.subscription.updated / customer.subscription.deleted -> keep local status in sync
     """
-    payload = await request.body()
+    payload = await _read_body_capped(request, _MAX_WEBHOOK_BYTES)
 
     # In real Stripe mode we require a signature. In fake mode we don't.
     is_fake = provider.__class__.__name__ == "FakeStripeProvider"
@@ -78,26 +194,152 @@ async def webhook(
     if not event_id or not event_type or not isinstance(obj, dict):
         raise HTTPException(status_code=400, detail="Malformed webhook event")
 
+    lookups = _StripeLookups(provider)
+
     # Record for idempotency/audit; ignore if duplicate
     md = _to_dict(obj.get("metadata") or {})
     project_id = _require(md, "project_id")
     if not project_id:
-     project_id = await _infer_project_id_for_event(event_type, obj, provider)
+        project_id = await _infer_project_id_for_event(event_type, obj, lookups)
     if not project_id:
         # As a last resort (schema requires NOT NULL), you can reject or bucket into a sentinel.
         # Opting to reject to avoid bad data.
         raise HTTPException(status_code=400, detail="project_id missing and could not be inferred")
 
     e_repo = EventRepo(db)
-    if not await e_repo.record_if_new(
+    is_new = await e_repo.record_if_new(
         provider="stripe",
         event_id=event_id,
         project_id=project_id,
         event_type=event_type,
-        payload=event,
-    ):
+        payload=payload,
+    )
+    # ACK now; apply after the response (the event row is committed by then).
+    # Stripe does not re-deliver after a 2xx: an attempt that fails leaves processed_at
+    # NULL and sweep_unprocessed_events picks it up. Duplicates are queued as well, which
+    # is harmless since _process_event skips anything already processed.
+    background_tasks.add_task(_process_event, event_id, event_type, obj, md, project_id, lookups)
+    if not is_new:
         return {"ok": True, "deduped": True}
+    return {"ok": True, "type": event_type, "queued": True}
 
+
+async def _process_event(
+    event_id: str,
+    event_type: str,
+    obj: Dict[str, Any],
+    md: Dict[str, Any],
+    project_id: str,
+    lookups: _StripeLookups,
+) -> None:
+    """
+    Apply a recorded event in its own transaction. claim_unprocessed stamps processed_at
+    under a row lock, so concurrent/repeated deliveries apply an event at most once;
+    a failure rolls the stamp back and leaves the event for the retry sweep.
+    """
+    try:
+        async with SessionLocal() as db:
+            async with db.begin():
+                if not await EventRepo(db).claim_unprocessed(provider="stripe", event_id=event_id):
+                    return
+                await _apply_event(db, lookups, event_type, obj, md, project_id)
+    except CircuitOpenError:
+        # Stripe is down, not the event's fault: retried without counting an attempt
+        log.warning("stripe_webhook_deferred", event_id=event_id, event_type=event_type)
+    except Exception as exc:
+        log.exception("stripe_webhook_processing_failed", event_id=event_id, event_type=event_type)
+        await _record_failure(event_id, exc)
+
+
+# -------------------- retry sweep --------------------
+
+# Events still unprocessed this long after they were received are retried; the grace
+# period keeps the sweep from racing the delivery's own background attempt.
+_SWEEP_INTERVAL_SECONDS = 60.0
+_SWEEP_GRACE = timedelta(minutes=2)
+_SWEEP_BATCH = 100
+# after this many failed attempts an event is left alone (attempts/last_error say why)
+_MAX_ATTEMPTS = 10
+
+
+async def _record_failure(event_id: str, exc: BaseException) -> None:
+    try:
+        async with SessionLocal() as db:
+            async with db.begin():
+                attempts = await EventRepo(db).record_failure(
+                    provider="stripe", event_id=event_id, error=f"{type(exc).__name__}: {exc}"
+                )
+        if attempts is not None and attempts >= _MAX_ATTEMPTS:
+            log.error("stripe_webhook_gave_up", event_id=event_id, attempts=attempts)
+    except Exception:
+        log.exception("stripe_webhook_record_failure_failed", event_id=event_id)
+
+
+async def sweep_unprocessed_events() -> int:
+    """
+    Re-apply up to one batch of recorded events whose background attempt failed (or whose
+    worker died before it ran). Each event is locked with SKIP LOCKED and applied in that
+    same transaction, so sweepers on different workers never wait on each other.
+    Returns the number of events attempted.
+    """
+    provider = get_stripe_provider()
+    received_before = datetime.now(tz=_UTC) - _SWEEP_GRACE
+    tried: List[UUID] = []
+    for _ in range(_SWEEP_BATCH):
+        event_id = None
+        try:
+            async with SessionLocal() as db:
+                async with db.begin():
+                    e_repo = EventRepo(db)
+                    event = await e_repo.lock_next_unprocessed(
+                        provider="stripe",
+                        received_before=received_before,
+                        max_attempts=_MAX_ATTEMPTS,
+                        exclude=tried,
+                    )
+                    if event is None:
+                        break
+                    # a failure below must not make this sweep pick the same event again
+                    tried.append(event.id)
+                    event_id = event.event_id
+                    await e_repo.claim_unprocessed(provider="stripe", event_id=event_id)
+                    payload = _to_dict(event.payload)
+                    obj = _to_dict(_to_dict(payload.get("data", {})).get("object"))
+                    md = _to_dict(obj.get("metadata") or {})
+                    await _apply_event(
+                        db, _StripeLookups(provider), event.event_type, obj, md, event.project_id
+                    )
+        except CircuitOpenError:
+            # the rest of the batch would fail the same way; try again next round
+            log.warning("stripe_webhook_sweep_deferred", event_id=event_id)
+            break
+        except Exception as exc:
+            log.exception("stripe_webhook_processing_failed", event_id=event_id)
+            if event_id is not None:
+                await _record_failure(event_id, exc)
+            else:
+                raise
+    return len(tried)
+
+
+async def run_event_sweeper() -> None:
+    """Background loop started with the app; cancelled on shutdown."""
+    while True:
+        await asyncio.sleep(_SWEEP_INTERVAL_SECONDS)
+        try:
+            await sweep_unprocessed_events()
+        except Exception:
+            log.exception("stripe_webhook_sweep_failed")
+
+
+async def _apply_event(
+    db: AsyncSession,
+    lookups: _StripeLookups,
+    event_type: str,
+    obj: Dict[str, Any],
+    md: Dict[str, Any],
+    project_id: str,
+) -> None:
     s_repo = SubscriptionRepo(db)
     i_repo = InvoiceRepo(db)
 
@@ -113,41 +355,30 @@ async def webhook(
             local_sub = await s_repo.get(UUID(local_id_str))
             if local_sub:
                 # Use provider wrapper (works for real & fake)
-                remote = _to_dict(provider.retrieve_subscription(session_sub_id))
-                await s_repo.update_from_stripe(
-                    local_sub,
-                    stripe_subscription_id=remote.get("id"),
-                    status=remote.get("status"),
-                    current_period_start=_utc_from_epoch(remote.get("current_period_start")),
-                    current_period_end=_utc_from_epoch(remote.get("current_period_end")),
-                    trial_end_at=_utc_from_epoch(remote.get("trial_end")),         
-                    cancel_at_period_end=bool(remote.get("cancel_at_period_end", False)),
-                )
-                await db.commit()
+                remote = await lookups.subscription(session_sub_id)
+                await s_repo.update_from_stripe(local_sub, stripe_subscription_id=remote.get("id"), **_sub_state(remote))
 
     elif event_type in ("invoice.payment_succeeded", "invoice.payment_failed"):
         # Mirror invoice
         inv = obj  # already a dict
-        # project id: prefer explicit metadata; else derive via subscription/customer metadata
-        proj = project_id or await _project_from_invoice(inv, provider)
-        if proj:
-            await i_repo.upsert_from_stripe(project_id=proj, inv=inv)
+        # project_id was resolved above (metadata, else subscription/customer lookups)
+        await i_repo.upsert_from_stripe(project_id=project_id, inv=inv)
 
         # Refresh local subscription if we know its stripe id
         sub_id = inv.get("subscription")
         if sub_id:
-            remote = _to_dict(provider.retrieve_subscription(sub_id))
-            local = await s_repo.get_by_stripe_id(sub_id)
-            if local:
-                await s_repo.update_from_stripe(
-                    local,
-                    status=remote.get("status"),
-                    current_period_start=_utc_from_epoch(remote.get("current_period_start")),
-                    current_period_end=_utc_from_epoch(remote.get("current_period_end")),
-                    trial_end_at=_utc_from_epoch(remote.get("trial_end")),   
-                    cancel_at_period_end=bool(remote.get("cancel_at_period_end", False)),
-                )
-        await db.commit()
+            # overlap the Stripe round-trip with the local lookup
+            remote_task = asyncio.create_task(lookups.subscription(sub_id))
+            try:
+                local = await s_repo.get_by_stripe_id(sub_id)
+                if local and not _invoice_confirms_local(event_type, inv, local):
+                    remote = await remote_task
+                    await s_repo.update_from_stripe(local, **_sub_state(remote))
+            finally:
+                # not needed (or the local lookup failed): stop waiting for it, and collect
+                # its outcome so an error is never left unretrieved
+                remote_task.cancel()
+                await asyncio.gather(remote_task, return_exceptions=True)
 
     elif event_type == "customer.subscription.updated":
         remote = obj
@@ -155,15 +386,7 @@ async def webhook(
         if sub_id:
             local = await s_repo.get_by_stripe_id(sub_id)
             if local:
-                await s_repo.update_from_stripe(
-                    local,
-                    status=remote.get("status"),
-                    current_period_start=_utc_from_epoch(remote.get("current_period_start")),
-                    current_period_end=_utc_from_epoch(remote.get("current_period_end")),
-                    trial_end_at=_utc_from_epoch(remote.get("trial_end")),            # ← add this
-                    cancel_at_period_end=bool(remote.get("cancel_at_period_end", False)),
-                )
-                await db.commit()
+                await s_repo.update_from_stripe(local, **_sub_state(remote))
 
     elif event_type == "customer.subscription.deleted":
         remote = obj
@@ -172,27 +395,33 @@ async def webhook(
             local = await s_repo.get_by_stripe_id(sub_id)
             if local:
                 await s_repo.update_from_stripe(local, status="canceled")
-                await db.commit()
 
     # no-op for other events (you can extend here)
-    return {"ok": True, "type": event_type}
 
 
 # -------------------- helpers for project inference --------------------
 
-async def _project_from_invoice(inv: Dict[str, Any], provider) -> Optional[str]:
+async def _project_from_invoice(inv: Dict[str, Any], lookups: _StripeLookups) -> Optional[str]:
     """
     Best-effort project id extraction when invoice lacks explicit metadata.project_id
     — try subscription.metadata then customer.metadata.
     """
+    # Invoices embed a snapshot of the subscription's metadata; no API call needed
+    details = _to_dict(inv.get("subscription_details") or {})
+    md = _to_dict(details.get("metadata") or {})
+    if "project_id" in md:
+        return md["project_id"]
+
     # Try subscription
     try:
         sub_id = inv.get("subscription")
         if sub_id:
-            s = _to_dict(provider.retrieve_subscription(sub_id))
+            s = await lookups.subscription(sub_id)
             md = _to_dict(s.get("metadata") or {})
             if "project_id" in md:
                 return md["project_id"]
+    except CircuitOpenError:
+        raise
     except Exception:
         pass
 
@@ -200,63 +429,55 @@ async def _project_from_invoice(inv: Dict[str, Any], provider) -> Optional[str]:
     try:
         cus_id = inv.get("customer")
         if cus_id:
-            c = _to_dict(provider.retrieve_customer(cus_id))
+            c = await lookups.customer(cus_id)
             md = _to_dict(c.get("metadata") or {})
             if "project_id" in md:
                 return md["project_id"]
+    except CircuitOpenError:
+        raise
     except Exception:
         pass
 
     return None
 
-async def _infer_project_id_for_event(event_type: str, obj: Dict[str, Any], provider) -> Optional[str]:
+async def _project_from_subscription(sub_id: Optional[str], lookups: _StripeLookups) -> Optional[str]:
+    """
+    subscription.metadata.project_id, falling back to the subscription's customer metadata.
+    """
+    try:
+        s = await lookups.subscription(sub_id) if sub_id else {}
+        md = _to_dict(s.get("metadata") or {})
+        if "project_id" in md:
+            return md["project_id"]
+        cus_id = s.get("customer")
+        if cus_id:
+            c = await lookups.customer(cus_id)
+            md = _to_dict(c.get("metadata") or {})
+            if "project_id" in md:
+                return md["project_id"]
+    except CircuitOpenError:
+        raise
+    except Exception:
+        pass
+    return None
+
+async def _infer_project_id_for_event(event_type: str, obj: Dict[str, Any], lookups: _StripeLookups) -> Optional[str]:
     """
-    Try to infer project_id when metadata.project_id is absent:
+    Try to infer project_id when metadata.project_id is absent (the caller has already checked obj.metadata):
       - invoice.*: use existing _project_from_invoice()
-      - customer.subscription.*: look at obj.metadata or fetch subscription/customer
+      - customer.subscription.*: fetch subscription/customer
       - checkout.session.completed: obj.subscription -> fetch subscription.metadata
     """
-    md = _to_dict(obj.get("metadata") or {})
-    if "project_id" in md:
-        return md["project_id"]
-
     # invoice.*
     if event_type.startswith("invoice."):
-        return await _project_from_invoice(obj, provider)
+        return await _project_from_invoice(obj, lookups)
 
     # customer.subscription.*
     if event_type.startswith("customer.subscription."):
-        sub_id = obj.get("id")
-        try:
-            s = _to_dict(provider.retrieve_subscription(sub_id)) if sub_id else {}
-            md2 = _to_dict(s.get("metadata") or {})
-            if "project_id" in md2:
-                return md2["project_id"]
-            # fallback via customer
-            cus_id = s.get("customer")
-            if cus_id:
-                c = _to_dict(provider.retrieve_customer(cus_id))
-                md3 = _to_dict(c.get("metadata") or {})
-                if "project_id" in md3:
-                    return md3["project_id"]
-        except Exception:
-            pass
+        return await _project_from_subscription(obj.get("id"), lookups)
 
     # checkout.session.completed
     if event_type == "checkout.session.completed":
-        sub_id = obj.get("subscription")
-        try:
-            s = _to_dict(provider.retrieve_subscription(sub_id)) if sub_id else {}
-            md2 = _to_dict(s.get("metadata") or {})
-            if "project_id" in md2:
-                return md2["project_id"]
-            cus_id = s.get("customer")
-            if cus_id:
-                c = _to_dict(provider.retrieve_customer(cus_id))
-                md3 = _to_dict(c.get("metadata") or {})
-                if "project_id" in md3:
-                    return md3["project_id"]
-        except Exception:
-            pass
+        return await _project_from_subscription(obj.get("subscription"), lookups)
 
-    return None
\ No newline at end of file
+    return None
@@ -2,11 +2,13 @@
 from __future__ import annotations
 from uuid import UUID
 from typing import List, Optional
-import hashlib, json 
+import hashlib
 
+import orjson
 from fastapi import APIRouter, Depends, Header, HTTPException, status, Query, Request
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.persistence.repo import SubscriptionRepo, IdempotencyRepo
+from app.api._orjson import ORJSONResponse
 from app.core.deps import get_db, get_stripe_provider
 from app.engine.engine import SubscriptionEngine, EngineError
 from app.schemas.api_models import (
@@ -16,11 +18,42 @@ from app.schemas.api_models import (
     CancelRequest,
     ResumeRequest,
 )
-from app.persistence.repo import SubscriptionRepo
 
-router = APIRouter(prefix="/subscriptions", tags=["Subscriptions"])
+router = APIRouter(prefix="/subscriptions", tags=["Subscriptions"], default_response_class=ORJSONResponse)
 
-@router.post("", response_model=SubscriptionResponse, status_code=status.HTTP_201_CREATED)
+
+def _iso(dt):
+    return dt.isoformat() if dt else None
+
+
+def _sub_to_dict(s) -> dict:
+    # same shape as SubscriptionResponse
+    return {
+        "id": s.id,
+        "projectId": s.project_id,
+        "accountId": s.account_id,
+        "planCode": s.plan_code,
+        "quantity": s.quantity,
+        "status": s.status,
+        "configVersionId": s.config_version_id,
+        "stripeCustomerId": s.stripe_customer_id,
+        "stripeSubscriptionId": s.stripe_subscription_id,
+        "currentPeriodStart": _iso(s.current_period_start),
+        "currentPeriodEnd": _iso(s.current_period_end),
+        "trialEndAt": _iso(s.trial_end_at),
+        "cancelAtPeriodEnd": s.cancel_at_period_end,
+        "checkoutUrl": getattr(s, "checkout_url", None),
+        "metadata": s.meta or None,
+    }
+
+
+def _stable_request_hash(payload: dict) -> str:
+    # blake2b-256: same 64-hex width as sha256, faster on builds without SHA extensions
+    raw = orjson.dumps(payload, option=orjson.OPT_SORT_KEYS)
+    return hashlib.blake2b(raw, digest_size=32).hexdigest()
+
+
+@router.post("", responses={201: {"model": SubscriptionResponse}}, status_code=status.HTTP_201_CREATED)
 async def create_subscription(
     body: CreateSubscriptionRequest,
     db: AsyncSession = Depends(get_db),
@@ -32,29 +65,29 @@ async def create_subscription(
     if not idempotency_key:
         raise HTTPException(status_code=400, detail={"type": "missing_header", "message": "Idempotency-Key required"})
 
-    def _stable_request_hash(payload: dict) -> str:
-        raw = json.dumps(payload, sort_keys=True, separators=(",", ":")).encode("utf-8")
-        return hashlib.sha256(raw).hexdigest()
-
     idem_repo = IdempotencyRepo(db)
     req_hash = _stable_request_hash(body.model_dump(mode="json"))
 
-    existing = await idem_repo.get(project_id=project_id, key=idempotency_key)
-    if existing:
-        if existing.status == "succeeded" and existing.response:
-            return SubscriptionResponse(**existing.response)
-        if existing.status == "in_progress":
+    row, created = await idem_repo.begin_or_get(project_id=project_id, key=idempotency_key, request_hash=req_hash)
+    if not created:
+        if row.status == "succeeded" and row.response:
+            # stored in JSON form already; replay as-is
+            return ORJSONResponse(content=row.response, status_code=status.HTTP_201_CREATED)
+        # failed -> reclaim the key and retry; in progress (or another retry won the reclaim) -> 409
+        reclaimed = None
+        if row.status == "failed":
+            reclaimed = await idem_repo.reclaim_failed(project_id=project_id, key=idempotency_key, request_hash=req_hash)
+        if reclaimed is None:
             raise HTTPException(status_code=409, detail={"type": "in_progress", "message": "Request is being processed"})
-        # if failed -> continue to retry
-
-    row = await idem_repo.create_in_progress(project_id=project_id, key=idempotency_key, request_hash=req_hash)
+        row = reclaimed
 
     try:
         engine = SubscriptionEngine(db=db, stripe=stripe, project_id=project_id)
         sub = await engine.create_subscription(body, idempotency_key=idempotency_key)  # pass key down
-        await idem_repo.mark_succeeded(row, response_payload=sub.model_dump(mode="json"))
+        payload = sub.model_dump(mode="json")
+        await idem_repo.mark_succeeded(row, response_payload=payload)
         await db.commit()
-        return sub
+        return ORJSONResponse(content=payload, status_code=status.HTTP_201_CREATED)
 
     except EngineError as e:
         await idem_repo.mark_failed(row, response_payload={"type": "validation_error", "message": str(e)})
@@ -66,63 +99,36 @@ async def create_subscription(
         await db.commit()
         raise
 
-@router.get("/{subscription_id}", response_model=SubscriptionResponse)
+@router.get("/{subscription_id}", responses={200: {"model": SubscriptionResponse}})
 async def get_subscription(
     subscription_id: UUID,
     db: AsyncSession = Depends(get_db),
     project_id: str = Header(..., alias="X-Project-Id"),
 ):
-    sub = await SubscriptionRepo(db).get(subscription_id)
-    if not sub or sub.project_id != project_id:
+    sub = await SubscriptionRepo(db).get_for_project(subscription_id, project_id)
+    if not sub:
         raise HTTPException(status_code=404, detail={"type":"not_found","message":"Subscription not found"})
-    # Map ORM → API (same as your original, but leave checkoutUrl as stored if you keep it)
-    return SubscriptionResponse(
-        id=sub.id,
-        projectId=sub.project_id,
-        accountId=sub.account_id,
-        planCode=sub.plan_code,
-        quantity=sub.quantity,
-        status=sub.status,
-        configVersionId=sub.config_version_id,
-        stripeCustomerId=sub.stripe_customer_id,
-        stripeSubscriptionId=sub.stripe_subscription_id,
-        currentPeriodStart=sub.current_period_start.isoformat() if sub.current_period_start else None,
-        currentPeriodEnd=sub.current_period_end.isoformat() if sub.current_period_end else None,
-        trialEndAt=sub.trial_end_at.isoformat() if sub.trial_end_at else None,
-        cancelAtPeriodEnd=sub.cancel_at_period_end,
-        checkoutUrl=getattr(sub, "checkout_url", None),
-        metadata=sub.meta or None,
-    )
-
-@router.get("", response_model=List[SubscriptionResponse])
+    # Map ORM → API (same shape as SubscriptionResponse)
+    return ORJSONResponse(content=_sub_to_dict(sub))
+
+@router.get("", responses={200: {"model": List[SubscriptionResponse]}})
 async def list_subscriptions_for_account(
     accountId: str = Query(..., min_length=1),
+    # opt-in paging: without `limit` the full list is returned, as before paging existed
+    limit: Optional[int] = Query(None, ge=1, le=200),
+    cursor: Optional[UUID] = Query(None),
     db: AsyncSession = Depends(get_db),
     project_id: str = Header(..., alias="X-Project-Id"),
 ):
-    subs = await SubscriptionRepo(db).list_for_account(project_id, accountId)
-    return [
-        SubscriptionResponse(
-            id=s.id,
-            projectId=s.project_id,
-            accountId=s.account_id,
-            planCode=s.plan_code,
-            quantity=s.quantity,
-            status=s.status,
-            configVersionId=s.config_version_id,
-            stripeCustomerId=s.stripe_customer_id,
-            stripeSubscriptionId=s.stripe_subscription_id,
-            currentPeriodStart=s.current_period_start.isoformat() if s.current_period_start else None,
-            currentPeriodEnd=s.current_period_end.isoformat() if s.current_period_end else None,
-            trialEndAt=s.trial_end_at.isoformat() if s.trial_end_at else None,      # <-- NEW
-            cancelAtPeriodEnd=s.cancel_at_period_end,
-            checkoutUrl=getattr(s, "checkout_url", None),
-            metadata=s.meta or None,
-        )
-        for s in subs
-    ]
+    subs = await SubscriptionRepo(db).list_for_account(project_id, accountId, limit=limit, cursor=cursor)
+    headers = {}
+    if limit is not None and len(subs) == limit:
+        # pass back as ?cursor= to fetch the next page
+        headers["X-Next-Cursor"] = str(subs[-1].id)
+    # rows come straight from the DB; skip per-row model validation
+    return ORJSONResponse(content=[_sub_to_dict(s) for s in subs], headers=headers)
 
-@router.post("/{subscription_id}/change-plan", response_model=SubscriptionResponse)
+@router.post("/{subscription_id}/change-plan", responses={200: {"model": SubscriptionResponse}})
 async def change_plan(
     subscription_id: UUID,
     body: ChangePlanRequest,
@@ -130,12 +136,12 @@ async def change_plan(
     stripe = Depends(get_stripe_provider),
     project_id: str = Header(..., alias="X-Project-Id"),
 ):
-    sub = await SubscriptionRepo(db).get(subscription_id)
-    if not sub or sub.project_id != project_id:
+    sub = await SubscriptionRepo(db).get_for_project(subscription_id, project_id)
+    if not sub:
         raise HTTPException(status_code=404, detail={"type": "not_found", "message": "Subscription not found"})
     engine = SubscriptionEngine(db=db, stripe=stripe, project_id=project_id)
     try:
-        return await engine.change_plan(
+        updated = await engine.change_plan(
             subscription=sub,
             new_plan_code=body.planCode,
             quantity=body.quantity,
@@ -143,8 +149,9 @@ async def change_plan(
         )
     except EngineError as e:
         raise HTTPException(status_code=400, detail={"type": "validation_error", "message": str(e)})
+    return ORJSONResponse(content=updated.model_dump(mode="json"))
 
-@router.post("/{subscription_id}/cancel", response_model=SubscriptionResponse)
+@router.post("/{subscription_id}/cancel", responses={200: {"model": SubscriptionResponse}})
 async def cancel_subscription(
     subscription_id: UUID,
     body: CancelRequest,
@@ -152,16 +159,17 @@ async def cancel_subscription(
     stripe = Depends(get_stripe_provider),
     project_id: str = Header(..., alias="X-Project-Id"),
 ):
-    sub = await SubscriptionRepo(db).get(subscription_id)
-    if not sub or sub.project_id != project_id:
+    sub = await SubscriptionRepo(db).get_for_project(subscription_id, project_id)
+    if not sub:
         raise HTTPException(status_code=404, detail={"type": "not_found", "message": "Subscription not found"})
     engine = SubscriptionEngine(db=db, stripe=stripe, project_id=project_id)
     try:
-        return await engine.cancel(subscription=sub, at_period_end=bool(body.cancelAtPeriodEnd))
+        updated = await engine.cancel(subscription=sub, at_period_end=bool(body.cancelAtPeriodEnd))
     except EngineError as e:
         raise HTTPException(status_code=400, detail={"type": "validation_error", "message": str(e)})
+    return ORJSONResponse(content=updated.model_dump(mode="json"))
 
-@router.post("/{subscription_id}/resume", response_model=SubscriptionResponse)
+@router.post("/{subscription_id}/resume", responses={200: {"model": SubscriptionResponse}})
 async def resume_subscription(
     subscription_id: UUID,
     body: ResumeRequest,
@@ -169,11 +177,12 @@ async def resume_subscription(
     stripe = Depends(get_stripe_provider),
     project_id: str = Header(..., alias="X-Project-Id"),
 ):
-    sub = await SubscriptionRepo(db).get(subscription_id)
-    if not sub or sub.project_id != project_id:
+    sub = await SubscriptionRepo(db).get_for_project(subscription_id, project_id)
+    if not sub:
         raise HTTPException(status_code=404, detail={"type": "not_found", "message": "Subscription not found"})
     engine = SubscriptionEngine(db=db, stripe=stripe, project_id=project_id)
     try:
-        return await engine.resume(subscription=sub)
+        updated = await engine.resume(subscription=sub)
     except EngineError as e:
-        raise HTTPException(status_code=400, detail={"type": "validation_error", "message": str(e)})
\ No newline at end of file
+        raise HTTPException(status_code=400, detail={"type": "validation_error", "message": str(e)})
+    return ORJSONResponse(content=updated.model_dump(mode="json"))
\ No newline at end of file
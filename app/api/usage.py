@@ -3,33 +3,47 @@ from typing import Optional
 from uuid import UUID
 from datetime import datetime, timezone
 
+import ciso8601
 from fastapi import APIRouter, Depends, Header, HTTPException, Query, status
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.api._orjson import ORJSONResponse
 from app.core.deps import get_db
 from app.schemas.api_models import (
     UsageEventRequest,
     UsageEventResponse,
     UsageSummaryResponse,
-    UsageSummaryItem,
 )
 from app.persistence.repo import UsageRepo, SubscriptionRepo, ConfigRepo
 
 router = APIRouter(prefix="/usage", tags=["Usage"])
 
+_UTC = timezone.utc
+
 def _now_utc() -> datetime:
-    return datetime.now(tz=timezone.utc)
+    return datetime.now(tz=_UTC)
+
+def _utc(dt: datetime) -> datetime:
+    # timestamptz columns usually come back already in UTC; skip the copy then
+    return dt if dt.tzinfo is _UTC else dt.astimezone(_UTC)
+
+def _parse_iso(v: str, message: str) -> datetime:
+    """
+    ISO8601 -> aware UTC datetime. Naive and zero-offset inputs (the common case)
+    just get tzinfo swapped; only real offsets pay for astimezone().
+    """
+    try:
+        dt = ciso8601.parse_datetime(v)  # C parser; handles the "Z" suffix itself
+    except ValueError:
+        raise HTTPException(status_code=400, detail={"type": "validation_error", "message": message})
+    if not dt.utcoffset():
+        return dt.replace(tzinfo=_UTC)
+    return dt.astimezone(_UTC)
 
 def _parse_iso_or_now(v: Optional[str]) -> datetime:
     if not v:
         return _now_utc()
-    try:
-        dt = datetime.fromisoformat(v.replace("Z", "+00:00"))
-        if dt.tzinfo is None:
-            dt = dt.replace(tzinfo=timezone.utc)
-        return dt.astimezone(timezone.utc)
-    except Exception:
-        raise HTTPException(status_code=400, detail={"type":"validation_error","message":"occurredAt must be ISO8601"})
+    return _parse_iso(v, "occurredAt must be ISO8601")
 
 @router.post("", response_model=UsageEventResponse, status_code=status.HTTP_201_CREATED)
 async def record_usage(
@@ -59,12 +73,12 @@ async def record_usage(
         accountId=row.account_id,
         metricKey=row.metric_key,
         quantity=float(row.quantity),
-        occurredAt=row.occurred_at.astimezone(timezone.utc).isoformat(),
+        occurredAt=_utc(row.occurred_at).isoformat(),
         sourceId=row.source_id,
         metadata=row.meta or None,
     )
 
-@router.get("/summary", response_model=UsageSummaryResponse)
+@router.get("/summary", responses={200: {"model": UsageSummaryResponse}})
 async def usage_summary(
     accountId: str = Query(..., min_length=1),
     start: Optional[str] = Query(None, description="ISO8601 inclusive start; default: subscription.current_period_start"),
@@ -77,34 +91,20 @@ async def usage_summary(
     If start/end are not provided, derives them from the latest subscription's current period.
     """
 
-    def _parse_optional_iso(s: Optional[str]) -> Optional[datetime]:
-        if not s:
-            return None
-        try:
-            dt = datetime.fromisoformat(s.replace("Z", "+00:00"))
-            if dt.tzinfo is None:
-                dt = dt.replace(tzinfo=timezone.utc)
-            return dt.astimezone(timezone.utc)
-        except Exception:
-            raise HTTPException(status_code=400, detail={"type": "validation_error", "message": "start/end must be ISO8601"})
-
     # Parse provided bounds (if any)
-    window_start: Optional[datetime] = _parse_optional_iso(start)
-    window_end: Optional[datetime] = _parse_optional_iso(end)
+    window_start: Optional[datetime] = _parse_iso(start, "start/end must be ISO8601") if start else None
+    window_end: Optional[datetime] = _parse_iso(end, "start/end must be ISO8601") if end else None
 
     # If missing, derive from latest subscription's current period
     if not window_start or not window_end:
-        srepo = SubscriptionRepo(db)
-        subs = await srepo.list_for_account(project_id, accountId)
-        active_like = [s for s in subs if s.status in ("trialing", "active", "past_due", "pending")]
-        sub = (active_like or subs)[0] if (active_like or subs) else None
-        if not sub or not sub.current_period_start or not sub.current_period_end:
+        period = await SubscriptionRepo(db).get_current_period(project_id, accountId)
+        if not period or not period[0] or not period[1]:
             raise HTTPException(
                 status_code=400,
                 detail={"type": "missing_window", "message": "Provide start/end or ensure subscription has current period"},
             )
-        window_start = sub.current_period_start.astimezone(timezone.utc)
-        window_end = sub.current_period_end.astimezone(timezone.utc)
+        window_start = _utc(period[0])
+        window_end = _utc(period[1])
 
     # Validate ordering
     if window_start >= window_end:
@@ -118,12 +118,13 @@ async def usage_summary(
     rows = await urepo.summarize_window(
         project_id=project_id, account_id=accountId, start=window_start, end=window_end
     )
-    items = [UsageSummaryItem(metricKey=mk, total=tot) for mk, tot in rows]
-
-    return UsageSummaryResponse(
-        projectId=project_id,
-        accountId=accountId,
-        windowStart=window_start.isoformat(),
-        windowEnd=window_end.isoformat(),
-        items=items,
-    )
\ No newline at end of file
+    # rows are (str, float) straight from the DB; no need to validate them into models
+    return ORJSONResponse(
+        {
+            "projectId": project_id,
+            "accountId": accountId,
+            "windowStart": window_start.isoformat(),
+            "windowEnd": window_end.isoformat(),
+            "items": [{"metricKey": mk, "total": tot} for mk, tot in rows],
+        }
+    )
@@ -0,0 +1,73 @@
+# app/core/circuit.py
+from __future__ import annotations
+import time
+from typing import Tuple, Type
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, name: str):
+        super().__init__(f"circuit '{name}' is open")
+        self.name = name
+
+
+class CircuitBreaker:
+    """
+    CLOSED -> OPEN after `failure_threshold` consecutive failures; OPEN fails fast until
+    `recovery_timeout` elapses, then HALF_OPEN lets a single probe through.
+    Only exceptions in `trip_on` count as failures (e.g. timeouts, 5xx), not 4xx lookups.
+    Exits that never saw the upstream's answer (cancellation, other BaseExceptions) are
+    neutral: they leave the state as it was and free the probe slot.
+
+        async with breaker:
+            ...
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        name: str,
+        *,
+        failure_threshold: int = 5,
+        recovery_timeout: float = 30.0,
+        trip_on: Tuple[Type[BaseException], ...] = (Exception,),
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.trip_on = trip_on
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+
+    async def __aenter__(self) -> "CircuitBreaker":
+        if self.state == self.OPEN:
+            if time.monotonic() - self._opened_at < self.recovery_timeout:
+                raise CircuitOpenError(self.name)
+            self.state = self.HALF_OPEN
+        elif self.state == self.HALF_OPEN:
+            # a probe is already in flight
+            raise CircuitOpenError(self.name)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> bool:
+        if exc_type is None:
+            self.state = self.CLOSED
+            self._failures = 0
+        elif not issubclass(exc_type, Exception):
+            # e.g. CancelledError: the call did not complete, so it proves nothing.
+            # Back to OPEN with the old timestamp lets the next caller probe right away.
+            if self.state == self.HALF_OPEN:
+                self.state = self.OPEN
+        elif issubclass(exc_type, self.trip_on):
+            self._failures += 1
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+        elif self.state == self.HALF_OPEN:
+            # the upstream answered (just not with success); treat as recovered
+            self.state = self.CLOSED
+            self._failures = 0
+        return False
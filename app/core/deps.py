@@ -1,20 +1,70 @@
 # app/core/deps.py
-from functools import lru_cache
+from contextvars import ContextVar
+from typing import Optional
 from collections.abc import AsyncGenerator
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.pool import NullPool
 from app.core.settings import settings
 from app.payments.stripe_provider import StripePaymentProvider
 from app.payments.fake_provider import FakeStripeProvider
 
-engine = create_async_engine(settings.DATABASE_URL, pool_pre_ping=True)
+def _driver_connect_args(url: str) -> dict:
+    # keep repeated statements (repos, idempotency middleware) prepared server-side,
+    # except behind a transaction-pooling PgBouncer where prepared statements break
+    if "+asyncpg" in url:
+        cache_size = 0 if settings.DB_USE_PGBOUNCER else settings.DB_STATEMENT_CACHE_SIZE
+        return {
+            "statement_cache_size": cache_size,
+            "prepared_statement_cache_size": cache_size,
+        }
+    if "+psycopg" in url:
+        # psycopg prepares a statement after it has run this many times on a connection
+        return {"prepare_threshold": None if settings.DB_USE_PGBOUNCER else 1}
+    return {}
+
+def _pool_args() -> dict:
+    if settings.DB_USE_PGBOUNCER:
+        # PgBouncer owns the pooling; a second pool here would just pin server slots
+        return {"poolclass": NullPool}
+    return {
+        "pool_pre_ping": True,
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+    }
+
+engine = create_async_engine(
+    settings.DATABASE_URL,
+    echo=settings.DB_ECHO,
+    connect_args=_driver_connect_args(settings.DATABASE_URL),
+    **_pool_args(),
+)
 SessionLocal = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
 
+# Set by IdempotencyMiddleware for the duration of a guarded request, so the endpoint
+# and the idempotency bookkeeping share one session (and one pooled connection).
+request_session: ContextVar[Optional[AsyncSession]] = ContextVar("request_session", default=None)
+
 async def get_db() -> AsyncGenerator[AsyncSession, None]:
+    shared = request_session.get()
+    if shared is not None:
+        # owned (and closed) by the middleware
+        yield shared
+        return
     async with SessionLocal() as session:
         yield session
 
-@lru_cache(maxsize=1)
-def _payments_singleton():
+async def get_db_txn() -> AsyncGenerator[AsyncSession, None]:
+    """
+    Session wrapped in one transaction: committed once when the handler returns,
+    rolled back if it raises. Handlers using this must not commit themselves.
+    """
+    async with SessionLocal() as session:
+        async with session.begin():
+            yield session
+
+def _make_payments_provider():
     if settings.PAYMENTS_BACKEND == "fake" or not settings.STRIPE_SECRET_KEY:
         return FakeStripeProvider()
     return StripePaymentProvider(
@@ -22,6 +72,8 @@ def _payments_singleton():
         webhook_secret=settings.STRIPE_WEBHOOK_SECRET,
     )
 
+_PAYMENTS_PROVIDER = _make_payments_provider()
+
 def get_stripe_provider():
-    # FastAPI will call this each request, but we return the cached singleton
-    return _payments_singleton()
\ No newline at end of file
+    # FastAPI calls this on every request; settings are fixed at import, so a plain global is enough
+    return _PAYMENTS_PROVIDER
@@ -2,6 +2,7 @@
 from __future__ import annotations
 import logging
 import sys
+import orjson
 import structlog
 from app.core.settings import settings
 
@@ -25,12 +26,16 @@ def setup_logging() -> None:
     if settings.DEV_MODE:
         processors.append(structlog.processors.ExceptionRenderer())
         processors.append(structlog.processors.KeyValueRenderer(sort_keys=True))
+        logger_factory = structlog.PrintLoggerFactory()
     else:
         processors.append(structlog.processors.dict_tracebacks)
-        processors.append(structlog.processors.JSONRenderer())
+        # orjson emits bytes; write them straight to stdout without a decode
+        processors.append(structlog.processors.JSONRenderer(serializer=orjson.dumps))
+        logger_factory = structlog.BytesLoggerFactory()
 
     structlog.configure(
         processors=processors,
         wrapper_class=structlog.make_filtering_bound_logger(level),
+        logger_factory=logger_factory,
         cache_logger_on_first_use=True,
     )
\ No newline at end of file
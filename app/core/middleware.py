@@ -2,13 +2,15 @@
 from __future__ import annotations
 
 import hashlib
-import json
-from typing import Optional
+
+import orjson
+from typing import List, Optional, Tuple
 from starlette.types import ASGIApp, Receive, Scope, Send, Message
 from starlette.responses import Response
 from sqlalchemy import text
 
-from app.core.deps import SessionLocal
+from app.core.cache import TTLCache
+from app.core.deps import SessionLocal, request_session
 
 IDEMPOTENCY_EXEMPT_PREFIXES = (
     "/health",
@@ -20,17 +22,46 @@ IDEMPOTENCY_EXEMPT_PREFIXES = (
     "/favicon.ico",
 )
 
+_GUARDED_METHODS = frozenset(("POST", "PUT", "PATCH", "DELETE"))
+
+_SELECT_KEY = text(
+    """
+    SELECT status, response::text, request_hash
+    FROM idempotency_keys
+    WHERE project_id=:p AND key=:k
+    """
+)
+_INSERT_KEY = text(
+    """
+    INSERT INTO idempotency_keys (project_id, key, request_hash, response, status)
+    VALUES (:p, :k, :h, CAST(:r AS json), :s)
+    ON CONFLICT (project_id, key) DO NOTHING
+    RETURNING 1
+    """
+)
+
+# fixed error bodies, serialized once
+_MISSING_HEADERS_BODY = orjson.dumps({"error": "Missing Idempotency-Key or X-Project-Id header"})
+_KEY_REUSED_BODY = orjson.dumps({"error": "Idempotency key reused with a different request body"})
+
+# (project_id, key) -> (request_hash, status_code, response body bytes).
+# Retries usually land on the same worker within seconds, so most replays skip Postgres.
+_IDEM_CACHE: TTLCache[Tuple[str, int, bytes]] = TTLCache(maxsize=10_000, ttl=600.0)
+
+
 class IdempotencyMiddleware:
     """
     Lean idempotency storage (Option A) that:
       - Applies to POST/PUT/PATCH/DELETE.
       - Exempts OPTIONS and well-known non-mutating paths.
       - Requires Idempotency-Key + X-Project-Id (422 if missing).
-      - Computes request body sha256 -> request_hash.
-      - If key exists:
+      - Computes request body blake2b-256 -> request_hash.
+      - If key exists (and was stored by this middleware, i.e. its status is an HTTP code):
           * if request_hash differs => 409 Conflict (prevents accidental reuse)
           * else return stored response (status + JSON body).
+        Keys an endpoint manages itself (word statuses) are passed through untouched.
       - Otherwise, calls downstream; if response status < 500, stores {response JSON, status, request_hash}.
+        Empty or non-JSON responses are stored with a NULL body and replayed without one.
     """
 
     def __init__(self, app: ASGIApp):
@@ -40,105 +71,104 @@ class IdempotencyMiddleware:
         if scope["type"] != "http":
             return await self.app(scope, receive, send)
 
-        method = (scope.get("method") or "GET").upper()
-        path = scope.get("path") or "/"
-
-        # Exempt preflight and specific routes
-        if method == "OPTIONS" or any(path.startswith(p) for p in IDEMPOTENCY_EXEMPT_PREFIXES):
+        # Only guard mutating methods (ASGI methods are already uppercase);
+        # this also lets OPTIONS preflight through
+        if scope["method"] not in _GUARDED_METHODS:
             return await self.app(scope, receive, send)
 
-        # Only guard mutating methods
-        if method not in ("POST", "PUT", "PATCH", "DELETE"):
+        # Exempt specific routes
+        if scope["path"].startswith(IDEMPOTENCY_EXEMPT_PREFIXES):
             return await self.app(scope, receive, send)
 
         # Pull headers we need
-        idem_key = _header(scope, b"idempotency-key")
-        project_id = _header(scope, b"x-project-id")
+        idem_key, project_id = _headers(scope, b"idempotency-key", b"x-project-id")
 
         if not idem_key or not project_id:
-            return await _json(
-                send,
-                422,
-                {"error": "Missing Idempotency-Key or X-Project-Id header"},
-            )
+            return await _write_min_json(send, 422, _MISSING_HEADERS_BODY)
 
         # Read entire request body once
-        full_body = await _read_body(receive)
-        req_hash = hashlib.sha256(full_body).hexdigest()
-
-        # Check existing key
+        full_body, req_hash = await _read_body_hashed(receive)
+
+        cache_key = (project_id, idem_key)
+        cached = _IDEM_CACHE.get(cache_key)
+        if cached is not None:
+            stored_hash, status_code, body_bytes = cached
+            if stored_hash != req_hash and not _legacy_hash_matches(stored_hash, full_body):
+                return await _write_min_json(send, 409, _KEY_REUSED_BODY)
+            await _write_min_json(send, status_code, body_bytes)
+            return
+
+        # One session for the lookup, the endpoint (via get_db) and the final INSERT:
+        # a single pool checkout per mutating request instead of two.
         async with SessionLocal() as session:
-            res = await session.execute(
-                text(
-                    """
-                    SELECT status, response, request_hash
-                    FROM idempotency_keys
-                    WHERE project_id=:p AND key=:k
-                    """
-                ),
-                {"p": project_id, "k": idem_key},
-            )
-            row = res.first()
-            if row:
-                status_str, stored_response, stored_hash = row
-                # If same key but different body => 409 Conflict
-                if stored_hash and stored_hash != req_hash:
-                    return await _json(
-                        send,
-                        409,
-                        {"error": "Idempotency key reused with a different request body"},
-                    )
-
-                # Return stored response
-                status_code = int(status_str) if status_str and status_str.isdigit() else 200
-                body_bytes = json.dumps(stored_response).encode("utf-8")
-                await _write_min_json(send, status_code, body_bytes)
-                return
-
-        # No stored response → forward request
-        # Re-inject body to downstream
-        async def receive_wrapper() -> Message:
-            nonlocal full_body
-            body = full_body
-            full_body = b""
-            return {"type": "http.request", "body": body, "more_body": False}
-
-        # Capture downstream response
-        captured_status = 200
-        captured_body = b""
-
-        async def send_wrapper(message: Message):
-            nonlocal captured_status, captured_body
-            if message["type"] == "http.response.start":
-                captured_status = int(message.get("status") or 200)
-                await send(message)
-            elif message["type"] == "http.response.body":
-                captured_body += message.get("body", b"")
-                await send(message)
-            else:
-                await send(message)
-
-        await self.app(scope, receive_wrapper, send_wrapper)
-
-        # Persist (best-effort) if < 500 and JSON-ish
-        if captured_status < 500:
+            token = request_session.set(session)
             try:
-                payload_to_store: Optional[object]
+                res = await session.execute(_SELECT_KEY, {"p": project_id, "k": idem_key})
+                row = res.first()
+                # Rows with a word status (in_progress/succeeded/failed) are owned by endpoints
+                # that run their own idempotency gate on the same table (POST /subscriptions,
+                # which hashes the parsed body). Those requests go through to the endpoint.
+                if row and row[0] and row[0].isdigit():
+                    status_str, stored_response, stored_hash = row
+                    # If same key but different body => 409 Conflict
+                    if stored_hash and stored_hash != req_hash and not _legacy_hash_matches(stored_hash, full_body):
+                        return await _write_min_json(send, 409, _KEY_REUSED_BODY)
+
+                    # Return stored response
+                    status_code = int(status_str)
+                    # stored as the JSON text the endpoint produced; send it back verbatim
+                    body_bytes = stored_response.encode() if stored_response is not None else b""
+                    if stored_hash:
+                        _IDEM_CACHE.set(cache_key, (stored_hash, status_code, body_bytes))
+                    await _write_min_json(send, status_code, body_bytes)
+                    return
+
+                # No stored response → forward request
+                # Re-inject body to downstream
+                async def receive_wrapper() -> Message:
+                    nonlocal full_body
+                    body = full_body
+                    full_body = b""
+                    return {"type": "http.request", "body": body, "more_body": False}
+
+                # Capture downstream response
+                captured_status = 200
+                captured_chunks: list[bytes] = []
+                captured_json = False
+
+                async def send_wrapper(message: Message):
+                    nonlocal captured_status, captured_json
+                    if message["type"] == "http.response.start":
+                        captured_status = int(message.get("status") or 200)
+                        for k, v in message.get("headers") or ():
+                            if k == b"content-type":
+                                captured_json = v.startswith(b"application/json")
+                        await send(message)
+                    elif message["type"] == "http.response.body":
+                        # only JSON bodies are kept; join once at the end, not per chunk
+                        if captured_json:
+                            captured_chunks.append(message.get("body", b""))
+                        await send(message)
+                    else:
+                        await send(message)
+
+                await self.app(scope, receive_wrapper, send_wrapper)
+            finally:
+                request_session.reset(token)
+
+            # Persist (best-effort) if < 500 and JSON-ish
+            if captured_status < 500:
                 try:
-                    payload_to_store = json.loads(captured_body.decode() or "null")
-                except Exception:
-                    # Not JSON — store as string inside JSON container
-                    payload_to_store = {"_non_json": captured_body.decode(errors="ignore")}
-
-                async with SessionLocal() as session:
-                    await session.execute(
-                        text(
-                            """
-                            INSERT INTO idempotency_keys (project_id, key, request_hash, response, status)
-                            VALUES (:p, :k, :h, :r, :s)
-                            ON CONFLICT (project_id, key) DO NOTHING
-                            """
-                        ),
+                    # keep the JSON text as-is (no parse/re-encode); anything else is only
+                    # remembered as "done", with its status and no body
+                    captured_body = b"".join(captured_chunks) if captured_json else b""
+                    payload_to_store = captured_body.decode() if captured_body else None
+
+                    # endpoints commit what they keep; drop anything they left uncommitted
+                    if session.in_transaction():
+                        await session.rollback()
+                    res = await session.execute(
+                        _INSERT_KEY,
                         {
                             "p": project_id,
                             "k": idem_key,
@@ -147,33 +177,49 @@ class IdempotencyMiddleware:
                             "s": str(captured_status),
                         },
                     )
+                    inserted = res.first() is not None
                     await session.commit()
-            except Exception:
-                # best-effort: never block response path
-                pass
+                    # only cache what we actually stored; a lost race keeps the other writer's row
+                    if inserted:
+                        _IDEM_CACHE.set(cache_key, (req_hash, captured_status, captured_body))
+                except Exception:
+                    # best-effort: never block response path
+                    pass
 
 
 # ---------- helpers ----------
 
-async def _read_body(receive: Receive) -> bytes:
+async def _read_body_hashed(receive: Receive) -> Tuple[bytes, str]:
+    """
+    Read the whole body (kept for replay downstream) and hash it chunk by chunk as it
+    arrives. blake2b-256: same 64-hex width as the sha256 it replaced, cheaper on large bodies.
+    """
+    hasher = hashlib.blake2b(digest_size=32)
     chunks: list[bytes] = []
     more = True
     while more:
         msg = await receive()
         if msg["type"] != "http.request":
             break
-        chunks.append(msg.get("body", b""))
+        chunk = msg.get("body", b"")
+        hasher.update(chunk)
+        chunks.append(chunk)
         more = msg.get("more_body", False)
-    return b"".join(chunks)
-
-def _header(scope: Scope, name: bytes) -> Optional[str]:
-    headers = dict((k.lower(), v) for k, v in (scope.get("headers") or []))
-    v = headers.get(name)
-    return v.decode() if v else None
-
-async def _json(send: Send, status_code: int, data: dict):
-    body = json.dumps(data).encode("utf-8")
-    await _write_min_json(send, status_code, body)
+    # the usual single-chunk body needs no join copy
+    body = chunks[0] if len(chunks) == 1 else b"".join(chunks)
+    return body, hasher.hexdigest()
+
+def _legacy_hash_matches(stored_hash: str, body: bytes) -> bool:
+    # keys stored before the switch hold sha256(body); only hashed on a mismatch
+    return hashlib.sha256(body).hexdigest() == stored_hash
+
+def _headers(scope: Scope, *names: bytes) -> List[Optional[str]]:
+    # one pass over the raw list; ASGI header names are already lowercase
+    found: dict = dict.fromkeys(names)
+    for k, v in scope.get("headers") or ():
+        if k in found:
+            found[k] = v.decode() or None
+    return [found[n] for n in names]
 
 async def _write_min_json(send: Send, status_code: int, body: bytes):
     await send(
@@ -182,7 +228,7 @@ async def _write_min_json(send: Send, status_code: int, body: bytes):
             "status": status_code,
             "headers": [
                 (b"content-type", b"application/json"),
-            ],
+            ] if body else [],
         }
     )
     await send(
@@ -1,29 +1,47 @@
 # app/core/security.py
 from __future__ import annotations
+import hashlib
 import time
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Tuple
 import jwt
 from fastapi import HTTPException, status
+from app.core.cache import TTLCache
 from app.core.settings import settings
 
+# blake2b-128(token) -> (exp, decoded claims). Only successfully verified tokens are
+# cached, and a hit is re-checked against `exp`, so an entry never outlives its token.
+_VERIFIED: TTLCache[Tuple[float, Dict[str, Any]]] = TTLCache(maxsize=4096, ttl=300.0)
+
+# settings are fixed at import; build the decode arguments once
+_DECODE_KWARGS: Dict[str, Any] = {
+    "key": settings.JWT_SECRET,
+    "algorithms": [settings.JWT_ALGORITHM],
+    "audience": settings.JWT_AUDIENCE or None,
+    "issuer": settings.JWT_ISSUER or None,
+    "options": {"require": ["exp"], "verify_signature": True},
+}
+
 
 def verify_jwt_token(token: str) -> Dict[str, Any]:
-    options = {"require": ["exp"], "verify_signature": True}
+    cache_key = hashlib.blake2b(token.encode(), digest_size=16).digest()
+    cached = _VERIFIED.get(cache_key)
+    if cached is not None:
+        if cached[0] > time.time():
+            # callers own the returned dict; never hand out the cached one
+            return dict(cached[1])
+        _VERIFIED.pop(cache_key)
+
     try:
-        payload = jwt.decode(
-            token,
-            settings.JWT_SECRET,
-            algorithms=[settings.JWT_ALGORITHM],
-            audience=settings.JWT_AUDIENCE if settings.JWT_AUDIENCE else None,
-            issuer=settings.JWT_ISSUER if settings.JWT_ISSUER else None,
-            options=options,
-        )
-        return payload
+        payload = jwt.decode(token, **_DECODE_KWARGS)
+        # PyJWT also accepts numeric strings for exp; it has already validated the value
+        _VERIFIED.set(cache_key, (float(payload["exp"]), payload))
+        return dict(payload)
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token expired")
     except jwt.InvalidTokenError as e:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=f"Invalid token: {e}")
 
+
 def mint_dev_token(
     *,
     sub: Optional[str] = None,
@@ -1,12 +1,15 @@
 from __future__ import annotations
+import asyncio
+from dataclasses import dataclass
 from typing import Optional, Tuple, Dict, Any, List
 from uuid import UUID
 from datetime import datetime, timezone
 
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.core.cache import TTLCache
 from app.engine.strategies.registry import build_bundle
-from app.persistence.repo import ConfigRepo, SubscriptionRepo
+from app.persistence.repo import ConfigRepo, ConfigSnapshot, SubscriptionRepo
 from app.persistence.models import Subscription
 from app.schemas.api_models import CreateSubscriptionRequest, SubscriptionResponse
 from app.payments.types import PaymentProvider  # interface for stripe/fake
@@ -16,18 +19,94 @@ class EngineError(ValueError):
     pass
 
 
+@dataclass(frozen=True)
+class _ParsedConfig:
+    version_id: UUID
+    currency: str
+    # plan code -> cadence -> first plan with that (code, cadence), in config order
+    plans_by_code: Dict[str, Dict[Optional[str], dict]]
+    # id(plan) -> why its required strategies are invalid; valid plans are absent
+    strategy_errors: Dict[int, str]
+
+
+# (project_id, config_version_id) -> validated/indexed view of that version.
+# Published versions never change, so each one is parsed once.
+_PARSED_CONFIGS: TTLCache[_ParsedConfig] = TTLCache(maxsize=256, ttl=3600.0)
+
+
+# (currency, cadence, amount in minor units) -> provider price id. Prices are looked up or
+# created by attributes, so the answer is stable; the TTL bounds staleness if one is archived.
+_PRICE_IDS: TTLCache[str] = TTLCache(maxsize=256, ttl=3600.0)
+
+_UTC = timezone.utc
+
+
 def _from_epoch(ts: Optional[int]) -> Optional[datetime]:
     if ts is None:
         return None
-    return datetime.fromtimestamp(int(ts), tz=timezone.utc)
+    return datetime.fromtimestamp(int(ts), tz=_UTC)
 
 
 def _iso(dt: Optional[datetime]) -> Optional[str]:
     if not dt:
         return None
-    if dt.tzinfo is None:
-        dt = dt.replace(tzinfo=timezone.utc)
-    return dt.astimezone(timezone.utc).isoformat()
+    tz = dt.tzinfo
+    # UTC (epoch conversions, timestamptz rows) and naive values need no conversion copy
+    if tz is _UTC:
+        return dt.isoformat()
+    if tz is None:
+        return dt.replace(tzinfo=_UTC).isoformat()
+    return dt.astimezone(_UTC).isoformat()
+
+
+def parse_config(project_id: str, cfg: ConfigSnapshot) -> _ParsedConfig:
+    """
+    Validated/indexed view of a config version, built once per version and shared by
+    the engine and the entitlements router. Raises EngineError for an invalid config.
+    """
+    key = (project_id, cfg.id)
+    parsed = _PARSED_CONFIGS.get(key)
+    if parsed is None:
+        plans_by_code: Dict[str, Dict[Optional[str], dict]] = {}
+        for p in SubscriptionEngine._plans_array(cfg.json):
+            if isinstance(p, dict):
+                cad = p.get("cadence")
+                by_cadence = plans_by_code.setdefault(p.get("code"), {})
+                by_cadence.setdefault(cad if isinstance(cad, str) else None, p)
+        strategy_errors: Dict[int, str] = {}
+        for by_cadence in plans_by_code.values():
+            for p in by_cadence.values():
+                err = SubscriptionEngine._required_strategies_error(p)
+                if err:
+                    strategy_errors[id(p)] = err
+        parsed = _ParsedConfig(
+            version_id=cfg.id,
+            currency=SubscriptionEngine._extract_currency(cfg.json),
+            plans_by_code=plans_by_code,
+            strategy_errors=strategy_errors,
+        )
+        _PARSED_CONFIGS.set(key, parsed)
+    return parsed
+
+
+def find_plan(
+    index: Dict[str, Dict[Optional[str], dict]], *, plan_code: str, cadence_hint: Optional[str]
+) -> dict:
+    """
+    Find a plan by code (and cadence if provided). If multiple with same code:
+    - prefer cadence_hint if present
+    - else prefer 'monthly'
+    - else first match
+    """
+    by_cadence = index.get(plan_code)
+    if not by_cadence:
+        raise EngineError(f"planCode '{plan_code}' not found")
+
+    return (
+        (cadence_hint and by_cadence.get(cadence_hint))
+        or by_cadence.get("monthly")
+        or next(iter(by_cadence.values()))
+    )
 
 
 class SubscriptionEngine:
@@ -57,6 +136,7 @@ class SubscriptionEngine:
     Notes:
     - We DO NOT expect a Stripe priceId in config.
     - We resolve Stripe price via provider.resolve_price_id(currency, cadence, price).
+    - Provider calls are blocking HTTP (stripe SDK); they run via asyncio.to_thread so the loop stays free.
     """
 
     def __init__(self, db: AsyncSession, stripe: PaymentProvider, project_id: str):
@@ -66,13 +146,16 @@ class SubscriptionEngine:
 
     # ---------------- helpers for config/schema ----------------
 
-    async def _load_config(self) -> dict:
+    async def _load_config_row(self) -> ConfigSnapshot:
         cfg = await ConfigRepo(self.db).get_latest(self.project_id)
         if not cfg:
             raise EngineError("No config published for this project")
         if not isinstance(cfg.json, dict):
             raise EngineError("Config JSON must be an object")
-        return cfg.json
+        return cfg
+
+    async def _load_config(self) -> _ParsedConfig:
+        return parse_config(self.project_id, await self._load_config_row())
 
     @staticmethod
     def _extract_currency(cfg_json: dict) -> str:
@@ -95,29 +178,6 @@ class SubscriptionEngine:
             return c
         return None
 
-    def _find_plan(self, plans: List[dict], *, plan_code: str, cadence_hint: Optional[str]) -> dict:
-        """
-        Find a plan by code (and cadence if provided). If multiple with same code:
-        - prefer cadence_hint if present
-        - else prefer 'monthly'
-        - else first match
-        """
-        matches = [p for p in plans if isinstance(p, dict) and p.get("code") == plan_code]
-        if not matches:
-            raise EngineError(f"planCode '{plan_code}' not found")
-
-        if len(matches) == 1:
-            return matches[0]
-
-        if cadence_hint:
-            for p in matches:
-                if p.get("cadence") == cadence_hint:
-                    return p
-        for p in matches:
-            if p.get("cadence") == "monthly":
-                return p
-        return matches[0]
-
     @staticmethod
     def _extract_cadence(plan: dict) -> str:
         cad = plan.get("cadence")
@@ -149,11 +209,24 @@ class SubscriptionEngine:
         return days
 
     @staticmethod
-    def _strategies(plan: dict) -> dict:
+    def _required_strategies_error(plan: dict) -> Optional[str]:
         s = plan.get("strategies")
         if not isinstance(s, dict):
-            raise EngineError("Plan 'strategies' must be an object")
-        return s
+            return "Plan 'strategies' must be an object"
+        for req in ("ProrationStrategy", "InvoicingStrategy", "EntitlementStrategy"):
+            if req not in s or not isinstance(s[req], str) or not s[req]:
+                return f"Plan 'strategies.{req}' is required and must be a string"
+        return None
+
+    async def _resolve_price_id(self, *, currency: str, cadence: str, unit_price: float) -> str:
+        key = (currency, cadence, int(round(unit_price * 100)))
+        price_id = _PRICE_IDS.get(key)
+        if price_id is None:
+            price_id = await asyncio.to_thread(
+                self.stripe.resolve_price_id, currency=currency, cadence=cadence, unit_price=unit_price
+            )
+            _PRICE_IDS.set(key, price_id)
+        return price_id
 
     @staticmethod
     def _decide_flow(request_checkout: Optional[bool]) -> str:
@@ -163,11 +236,7 @@ class SubscriptionEngine:
         - checkout=False -> direct
         - None           -> checkout (safe default)
         """
-        if request_checkout is True:
-            return "checkout"
-        if request_checkout is False:
-            return "direct"
-        return "checkout"
+        return "direct" if request_checkout is False else "checkout"
 
     # ---------------- public operations ----------------
 
@@ -182,37 +251,36 @@ class SubscriptionEngine:
         if body.quantity is None or body.quantity < 1:
             raise EngineError("quantity must be >= 1")
 
-        cfg_json = await self._load_config()
-        currency = self._extract_currency(cfg_json)
-        plans = self._plans_array(cfg_json)
+        cfg = await self._load_config()
+        currency = cfg.currency
+        index = cfg.plans_by_code
 
         cadence_hint = self._pick_cadence_hint(body.metadata)
-        plan = self._find_plan(plans, plan_code=body.planCode, cadence_hint=cadence_hint)
+        plan = find_plan(index, plan_code=body.planCode, cadence_hint=cadence_hint)
 
         cadence = self._extract_cadence(plan)
         unit_price = self._extract_price(plan)
         trial_days = self._trial_days(plan)
 
-        # --- NEW: enforce required strategy keys from schema ---
-        s = self._strategies(plan)
-        for req in ("ProrationStrategy", "InvoicingStrategy", "EntitlementStrategy"):
-            if req not in s or not isinstance(s[req], str) or not s[req]:
-                raise EngineError(f"Plan 'strategies.{req}' is required and must be a string")
+        # --- NEW: enforce required strategy keys from schema (checked once per config version) ---
+        err = cfg.strategy_errors.get(id(plan))
+        if err:
+            raise EngineError(err)
 
         # build strategies bundle (your strategy classes can still read plan details)
         bundle = build_bundle(plan)
 
-        # resolve Stripe price_id based on (currency, cadence, unit_price)
-        price_id = self.stripe.resolve_price_id(
-            currency=currency, cadence=cadence, unit_price=unit_price
-        )
-
-        # Ensure customer
-        customer_id = self.stripe.ensure_customer(
-            account_id=body.accountId,
-            project_id=self.project_id,
-            email=None,
-            metadata=(body.metadata or {}),
+        # resolve Stripe price_id (from currency, cadence, unit_price) and ensure the customer;
+        # independent lookups, so their round-trips overlap
+        price_id, customer_id = await asyncio.gather(
+            self._resolve_price_id(currency=currency, cadence=cadence, unit_price=unit_price),
+            asyncio.to_thread(
+                self.stripe.ensure_customer,
+                account_id=body.accountId,
+                project_id=self.project_id,
+                email=None,
+                metadata=(body.metadata or {}),
+            ),
         )
 
         flow = self._decide_flow(body.checkout)
@@ -225,7 +293,7 @@ class SubscriptionEngine:
             plan_code=body.planCode,
             quantity=body.quantity,
             status="pending",
-            config_version_id=(await ConfigRepo(self.db).get_latest(self.project_id)).id,
+            config_version_id=cfg.version_id,  # the version the plan was validated against
             stripe_customer_id=customer_id,
             stripe_subscription_id=None,
             current_period_start=None,
@@ -235,19 +303,13 @@ class SubscriptionEngine:
             currency=currency,
             unit_price=unit_price,
         )
-        await self.db.commit()
-
-        checkout_url: Optional[str] = None
-        stripe_sub_id: Optional[str] = None
-        current_period_start: Optional[datetime] = None
-        current_period_end: Optional[datetime] = None
-        status: str = "pending"
-        trial_end_at: Optional[datetime] = None
+        # flushed, so sub.id is known for the Stripe metadata; committed once below
 
         if flow == "checkout":
             success_url = "https://example.com/success?session_id={CHECKOUT_SESSION_ID}"
             cancel_url = "https://example.com/cancel"
-            checkout_url, _session_id = self.stripe.create_checkout_session(
+            checkout_url, _session_id = await asyncio.to_thread(
+                self.stripe.create_checkout_session,
                 customer_id=customer_id,
                 price_id=price_id,
                 quantity=body.quantity,
@@ -266,18 +328,12 @@ class SubscriptionEngine:
                     "unit_price": unit_price,
                 },
             )
-            status = "pending"
-
-            # Optional persistence of checkout_url if your model has the column.
-            try:
-                sub = await repo.update(sub, checkout_url=checkout_url)
-                await self.db.commit()
-            except TypeError:
-                # repo.update does not accept checkout_url → ignore silently
-                pass
+            # row stays pending until the checkout webhook lands
+            sub = await repo.update(sub, checkout_url=checkout_url)
 
         else:
-            created = self.stripe.create_subscription(
+            created = await asyncio.to_thread(
+                self.stripe.create_subscription,
                 customer_id=customer_id,
                 price_id=price_id,
                 quantity=body.quantity,
@@ -296,40 +352,19 @@ class SubscriptionEngine:
                     "unit_price": unit_price,
                 },
             )
-            stripe_sub_id = created["id"]
-            status = created["status"]
-            current_period_start = _from_epoch(created.get("current_period_start"))
-            current_period_end = _from_epoch(created.get("current_period_end"))
-            trial_end_at = _from_epoch(created.get("trial_end"))
-
             sub = await repo.update(
                 sub,
-                stripe_subscription_id=stripe_sub_id,
-                status=status,
-                current_period_start=current_period_start,
-                current_period_end=current_period_end,
-                trial_end_at=trial_end_at,
+                stripe_subscription_id=created["id"],
+                status=created["status"],
+                current_period_start=_from_epoch(created.get("current_period_start")),
+                current_period_end=_from_epoch(created.get("current_period_end")),
+                trial_end_at=_from_epoch(created.get("trial_end")),
             )
-            await self.db.commit()
 
-        # DTO
-        return SubscriptionResponse(
-            id=sub.id,
-            projectId=sub.project_id,
-            accountId=sub.account_id,
-            planCode=sub.plan_code,
-            quantity=sub.quantity,
-            status=status,
-            configVersionId=sub.config_version_id,
-            stripeCustomerId=sub.stripe_customer_id,
-            stripeSubscriptionId=stripe_sub_id or sub.stripe_subscription_id,
-            currentPeriodStart=_iso(current_period_start or sub.current_period_start),
-            currentPeriodEnd=_iso(current_period_end or sub.current_period_end),
-            trialEndAt=_iso(trial_end_at or sub.trial_end_at),
-            cancelAtPeriodEnd=sub.cancel_at_period_end,
-            checkoutUrl=checkout_url if flow == "checkout" else getattr(sub, "checkout_url", None),
-            metadata=sub.meta or {},
-        )
+        await self.db.commit()
+
+        # the row now holds everything the response needs (expire_on_commit=False, so no reload)
+        return self._dto(sub)
 
     async def change_plan(
         self,
@@ -342,9 +377,9 @@ class SubscriptionEngine:
         if quantity < 1:
             raise EngineError("quantity must be >= 1")
 
-        cfg_json = await self._load_config()
-        currency = self._extract_currency(cfg_json)
-        plans = self._plans_array(cfg_json)
+        cfg = await self._load_config()
+        currency = cfg.currency
+        index = cfg.plans_by_code
 
         cadence_hint = None
         if isinstance(subscription.meta, dict):
@@ -352,23 +387,23 @@ class SubscriptionEngine:
             if isinstance(h, str) and h in ("monthly", "annual"):
                 cadence_hint = h
 
-        plan = self._find_plan(plans, plan_code=new_plan_code, cadence_hint=cadence_hint)
+        plan = find_plan(index, plan_code=new_plan_code, cadence_hint=cadence_hint)
         cadence = self._extract_cadence(plan)
         unit_price = self._extract_price(plan)
 
         # validate strategies here too (defensive)
-        s = self._strategies(plan)
-        for req in ("ProrationStrategy", "InvoicingStrategy", "EntitlementStrategy"):
-            if req not in s or not isinstance(s[req], str) or not s[req]:
-                raise EngineError(f"Plan 'strategies.{req}' is required and must be a string")
+        err = cfg.strategy_errors.get(id(plan))
+        if err:
+            raise EngineError(err)
 
-        price_id = self.stripe.resolve_price_id(currency=currency, cadence=cadence, unit_price=unit_price)
+        price_id = await self._resolve_price_id(currency=currency, cadence=cadence, unit_price=unit_price)
         bundle = build_bundle(plan)
 
         if not subscription.stripe_subscription_id:
             raise EngineError("Stripe subscription not set; cannot change plan")
 
-        updated = self.stripe.update_subscription(
+        updated = await asyncio.to_thread(
+            self.stripe.update_subscription,
             subscription_id=subscription.stripe_subscription_id,
             price_id=price_id,
             quantity=quantity,
@@ -393,7 +428,8 @@ class SubscriptionEngine:
         if not subscription.stripe_subscription_id:
             raise EngineError("Stripe subscription not set; cannot cancel")
 
-        res = self.stripe.cancel_subscription(
+        res = await asyncio.to_thread(
+            self.stripe.cancel_subscription,
             subscription_id=subscription.stripe_subscription_id,
             at_period_end=at_period_end,
         )
@@ -410,7 +446,9 @@ class SubscriptionEngine:
         if not subscription.stripe_subscription_id:
             raise EngineError("Stripe subscription not set; cannot resume")
 
-        res = self.stripe.resume_subscription(subscription_id=subscription.stripe_subscription_id)
+        res = await asyncio.to_thread(
+            self.stripe.resume_subscription, subscription_id=subscription.stripe_subscription_id
+        )
         repo = SubscriptionRepo(self.db)
         subscription = await repo.update(
             subscription,
@@ -423,7 +461,8 @@ class SubscriptionEngine:
     # ---------------- DTO ----------------
 
     def _dto(self, sub: Subscription) -> SubscriptionResponse:
-        return SubscriptionResponse(
+        # fields map 1:1 from a loaded row, so construct without validation
+        return SubscriptionResponse.model_construct(
             id=sub.id,
             projectId=sub.project_id,
             accountId=sub.account_id,
@@ -22,18 +22,9 @@ class StaticEntitlement(EntitlementStrategy):
             if not k:
                 continue
 
-            # Copy common fields (extend as needed)
-            entry: Dict[str, Any] = {}
-            for field in ("limit", "included", "overagePrice", "unit", "description"):
-                if field in f:
-                    entry[field] = f[field]
-
-            # keep any extra custom fields (except "key")
-            for kk, vv in f.items():
-                if kk not in entry and kk != "key":
-                    entry[kk] = vv
-
-            out["features"][k] = entry
+            # every field except "key" (limit, included, overagePrice, unit, description, custom ones),
+            # copied in one pass so overrides below can update it in place
+            out["features"][k] = {kk: vv for kk, vv in f.items() if kk != "key"}
 
         # Optional overrides (e.g. subscription.meta.entitlements / .features)
         if isinstance(overrides, dict):
@@ -1,5 +1,6 @@
 from __future__ import annotations
-from typing import Dict, Type
+from functools import lru_cache
+from typing import Dict, Optional, Type
 from app.engine.strategies.base import (
     StrategyBundle,
     ProrationStrategy,
@@ -38,27 +39,31 @@ SEATS: Dict[str, Type[SeatStrategy]] = {
     "pooled-seats": PooledSeats,
 }
 
-def _build_or_default(mapping, key: str, default_cls):
-    cls = mapping.get(key) or default_cls
-    return cls()
+# order matches _bundle_for's parameters
+_STRATEGY_KEYS = ("ProrationStrategy", "InvoicingStrategy", "EntitlementStrategy", "MeteringStrategy", "SeatStrategy")
+_NO_STRATEGIES: Dict[str, str] = {}
 
 def build_bundle(plan: dict) -> StrategyBundle:
     """
     Reads plan['strategies'] and returns a concrete StrategyBundle.
     Falls back to sensible defaults if missing.
     """
-    strategies = (plan.get("strategies") or {})
-
-    proration = _build_or_default(PRORATION, strategies.get("ProrationStrategy"), LinearProration)
-    invoicing = _build_or_default(INVOICING, strategies.get("InvoicingStrategy"), AutoCharge)
-    entitlement = _build_or_default(ENTITLEMENT, strategies.get("EntitlementStrategy"), StaticEntitlement)
-    metering = _build_or_default(METERING, strategies.get("MeteringStrategy"), MonthlyWindow)
-    seats = _build_or_default(SEATS, strategies.get("SeatStrategy"), PooledSeats)
+    strategies = plan.get("strategies") or _NO_STRATEGIES
+    return _bundle_for(*map(strategies.get, _STRATEGY_KEYS))
 
+@lru_cache(maxsize=128)
+def _bundle_for(
+    proration: Optional[str],
+    invoicing: Optional[str],
+    entitlement: Optional[str],
+    metering: Optional[str],
+    seats: Optional[str],
+) -> StrategyBundle:
+    # strategies are stateless, so one bundle per combination of names can be shared
     return StrategyBundle(
-        proration=proration,
-        invoicing=invoicing,
-        entitlement=entitlement,
-        metering=metering,
-        seats=seats,
-    )
\ No newline at end of file
+        proration=(PRORATION.get(proration) or LinearProration)(),
+        invoicing=(INVOICING.get(invoicing) or AutoCharge)(),
+        entitlement=(ENTITLEMENT.get(entitlement) or StaticEntitlement)(),
+        metering=(METERING.get(metering) or MonthlyWindow)(),
+        seats=(SEATS.get(seats) or PooledSeats)(),
+    )
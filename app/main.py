@@ -1,9 +1,14 @@
 # app/main.py
 from __future__ import annotations
+import asyncio
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI, Request, Depends
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 
+from app.api._orjson import ORJSONResponse
+from app.core.circuit import CircuitOpenError
 from app.core.logger import setup_logging
 from app.core.middleware import IdempotencyMiddleware
 from app.core.security import verify_jwt_token, mint_dev_token
@@ -20,7 +25,21 @@ from app.api import (
 
 setup_logging()
 
-app = FastAPI(title="Config-driven Subscription Service", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    sweeper = asyncio.create_task(stripe_webhooks.run_event_sweeper())
+    try:
+        yield
+    finally:
+        sweeper.cancel()
+
+
+app = FastAPI(
+    title="Config-driven Subscription Service",
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan,
+)
 
 # --- CORS ---
 allow_origins = ["*"] if settings.CORS_ORIGINS == "*" else [o.strip() for o in settings.CORS_ORIGINS.split(",")]
@@ -33,6 +52,8 @@ app.add_middleware(
     allow_credentials=settings.CORS_ALLOW_CREDENTIALS,
     allow_methods=allow_methods,
     allow_headers=allow_headers,
+    # browsers hide non-safelisted response headers from JS unless exposed
+    expose_headers=["X-Next-Cursor"],
 )
 
 # --- Idempotency ---
@@ -47,6 +68,13 @@ app.include_router(stripe_webhooks.router)
 app.include_router(health.router)
 app.include_router(entitlements.router) 
 
+# Upstream (Stripe) circuit open: fail fast. For webhooks this only covers project
+# inference before the ACK (Stripe re-delivers on 5xx); failures after the ACK are
+# retried by stripe_webhooks.run_event_sweeper.
+@app.exception_handler(CircuitOpenError)
+async def circuit_open_handler(request: Request, exc: CircuitOpenError):
+    return JSONResponse({"error": str(exc)}, status_code=503, headers={"Retry-After": "30"})
+
 # Paths that bypass auth (health, docs, and Stripe webhook)
 AUTH_EXEMPT_PREFIXES = (
     "/health",
@@ -65,7 +93,7 @@ async def authenticate_request(request: Request, call_next):
         return await call_next(request)
 
     path = request.url.path
-    if any(path.startswith(p) for p in AUTH_EXEMPT_PREFIXES):
+    if path.startswith(AUTH_EXEMPT_PREFIXES):
         return await call_next(request)
 
     # Require JWT + project header
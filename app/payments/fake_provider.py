@@ -1,9 +1,10 @@
 # app/payments/fake_provider.py
 from __future__ import annotations
 from typing import Tuple, Optional, Dict, Any
-import json
 from datetime import datetime, timedelta, timezone
 
+import orjson
+
 class FakeStripeProvider:
     """
     In-memory, protocol-compliant fake for tests/local runs.
@@ -56,9 +57,8 @@ class FakeStripeProvider:
         In fake, ignore signature and just parse the payload as JSON.
         Compatible with real handler expecting a dict-like event.
         """
-        if isinstance(payload, (bytes, bytearray)):
-            payload = payload.decode("utf-8")
-        return json.loads(payload)
+        # orjson takes bytes or str directly; no decode step
+        return orjson.loads(payload)
 
     # --------------------- customers -----------------------
 
@@ -0,0 +1,39 @@
+# app/payments/signature.py
+from __future__ import annotations
+import hashlib
+import hmac
+import time
+from typing import Any, Dict
+
+import orjson
+
+DEFAULT_TOLERANCE = 300  # seconds, same as stripe.Webhook
+
+
+def verify_stripe_signature(
+    payload: bytes, header: str, secret: str, tolerance: int = DEFAULT_TOLERANCE
+) -> Dict[str, Any]:
+    """
+    Verify a Stripe-Signature header ("t=<ts>,v1=<hex>[,v1=...][,v0=...]") and return the
+    parsed event. One pass over the header, one HMAC-SHA256, constant-time compares.
+    Raises ValueError on any mismatch.
+    """
+    ts = None
+    signatures = []
+    for item in header.split(","):
+        k, _, v = item.strip().partition("=")
+        if k == "t":
+            ts = v
+        elif k == "v1":
+            signatures.append(v.encode("ascii", "ignore"))
+    if ts is None or not ts.isdigit() or not signatures:
+        raise ValueError("Malformed Stripe-Signature header")
+    if tolerance and abs(time.time() - int(ts)) > tolerance:
+        raise ValueError("Timestamp outside the tolerance zone")
+
+    expected = hmac.new(
+        secret.encode("utf-8"), ts.encode("ascii") + b"." + payload, hashlib.sha256
+    ).hexdigest().encode("ascii")
+    if not any(hmac.compare_digest(expected, sig) for sig in signatures):
+        raise ValueError("No signatures found matching the expected signature")
+    return orjson.loads(payload)
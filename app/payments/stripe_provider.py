@@ -3,8 +3,13 @@ from typing import Optional, Tuple, Dict, Any
 import stripe
 from fastapi import HTTPException
 
+from app.payments.signature import verify_stripe_signature
+
 _INTERVAL_MAP = {"monthly": "month", "annual": "year"}
 
+# Errors that mean "Stripe is unreachable/unhealthy" rather than "bad request"
+TRANSIENT_ERRORS = (stripe.APIConnectionError, stripe.RateLimitError, stripe.APIError)
+
 
 class StripePaymentProvider:
     def __init__(self, api_key: str, webhook_secret: str):
@@ -57,7 +62,7 @@ class StripePaymentProvider:
     # --- webhooks/signature ---
     def verify_signature(self, payload: bytes, sig_header: str):
         try:
-            return stripe.Webhook.construct_event(payload, sig_header, self.webhook_secret)
+            return verify_stripe_signature(payload, sig_header, self.webhook_secret)
         except Exception:
             raise HTTPException(status_code=400, detail="Invalid Stripe signature")
 
@@ -13,9 +13,10 @@ from sqlalchemy import (
     Text,
     UniqueConstraint,
     Boolean,
+    CHAR,
     text as sqltext,
 )
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.dialects.postgresql import JSONB, UUID
 from sqlalchemy.orm import declarative_base, relationship
 from sqlalchemy.sql import func
 from .base import Base
@@ -32,6 +33,8 @@ class ConfigVersion(Base):
     project_id = Column(String, nullable=False, index=True)
     version_label = Column(String, nullable=False)
     json = Column(JSON, nullable=False)
+    # sha256 of the canonical JSON, computed once at publish (NULL for rows published before it existed)
+    etag = Column(CHAR(64), nullable=True)
 
     created_at = Column(
         TIMESTAMP(timezone=True),
@@ -123,13 +126,27 @@ class PaymentEvent(Base):
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     project_id = Column(String, nullable=False, index=True)
     provider = Column(String, nullable=False, index=True)     # e.g. 'stripe'
+    event_id = Column(String, nullable=False)                 # provider's event id (Stripe 'evt_...')
     event_type = Column(String, nullable=False, index=True)
-    payload = Column(JSON, nullable=False)                    # raw provider payload
+    payload = Column(JSONB, nullable=False)                   # raw provider payload
     received_at = Column(
         TIMESTAMP(timezone=True),
         server_default=sqltext("timezone('utc', now())"),
         nullable=False,
     )
+    processed_at = Column(TIMESTAMP(timezone=True), nullable=True)  # set once handlers have applied it
+    attempts = Column(Integer, nullable=False, server_default=sqltext("0"))  # failed apply attempts
+    last_error = Column(Text, nullable=True)
+
+    __table_args__ = (
+        UniqueConstraint("provider", "event_id", name="uq_payment_events_provider_event"),
+        # retry sweep: only the (few) events still waiting to be applied
+        Index(
+            "ix_payment_events_unprocessed",
+            "received_at",
+            postgresql_where=sqltext("processed_at IS NULL"),
+        ),
+    )
 
 
 # -------------------------
@@ -162,6 +179,9 @@ class Invoice(Base):
     period_start = Column(TIMESTAMP(timezone=True), nullable=True)
     period_end = Column(TIMESTAMP(timezone=True), nullable=True)
 
+    # read-side only; lines are replaced via InvoiceRepo.replace_lines_from_stripe_payload
+    lines = relationship("InvoiceLine", order_by="InvoiceLine.id", viewonly=True)
+
 # -------------------------
 # Invoice Lines
 # -------------------------
@@ -217,6 +237,25 @@ class UsageRecord(Base):
         Index("ix_usage_window", "project_id", "account_id", "metric_key", "occurred_at"),
     )
 
+
+class UsageRollupHour(Base):
+    """
+    Hourly pre-aggregate of usage_records, maintained by UsageRepo.upsert_event.
+    Summaries read whole hours from here and only scan raw rows for the partial edges.
+    """
+    __tablename__ = "usage_rollup_hour"
+
+    project_id = Column(String, primary_key=True)
+    account_id = Column(String, primary_key=True)
+    metric_key = Column(String, primary_key=True)
+    bucket_hour = Column(TIMESTAMP(timezone=True), primary_key=True)
+
+    qty_sum = Column(Numeric(precision=20, scale=6, asdecimal=True), nullable=False)
+
+    __table_args__ = (
+        Index("ix_usage_rollup_window", "project_id", "account_id", "bucket_hour"),
+    )
+
 # -------------------------
 # Entitlements Cache
 # -------------------------
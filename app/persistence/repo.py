@@ -1,12 +1,19 @@
 from __future__ import annotations
-from typing import Optional, List
+import hashlib
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, Optional, List, Sequence, Tuple, Union
 from uuid import UUID
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 
+import orjson
 from fastapi import HTTPException
-from sqlalchemy import desc, func, select
+from sqlalchemy import Text, and_, case, cast, desc, func, literal, or_, select, tuple_, union_all, update
+from sqlalchemy.dialects.postgresql import JSONB, insert as pg_insert
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import load_only, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
 
+from app.core.cache import TTLCache
 from app.persistence.models import (
     ConfigVersion,
     EntitlementsCache,
@@ -16,10 +23,39 @@ from app.persistence.models import (
     PaymentEvent,
     Invoice,
     UsageRecord,
+    UsageRollupHour,
 )
 
 # -------------------- Configs --------------------
 
+@dataclass(frozen=True)
+class ConfigSnapshot:
+    """
+    Session-independent copy of a ConfigVersion row. Treat `json` as read-only:
+    the same snapshot is shared by every request that hits the latest-config cache.
+    """
+    id: UUID
+    project_id: str
+    version_label: str
+    json: Dict[str, Any]
+    etag: Optional[str]
+
+    @classmethod
+    def from_row(cls, row: ConfigVersion) -> "ConfigSnapshot":
+        return cls(
+            id=row.id,
+            project_id=row.project_id,
+            version_label=row.version_label,
+            json=row.json,
+            etag=row.etag,
+        )
+
+
+# Latest config per project, cached briefly in-process. Publishing invalidates it
+# locally; other workers pick up the new version once the TTL lapses.
+_LATEST_CONFIG: TTLCache[ConfigSnapshot] = TTLCache(maxsize=1024, ttl=5.0)
+
+
 class ConfigRepo:
     def __init__(self, db: AsyncSession):
         self.db = db
@@ -35,12 +71,34 @@ class ConfigRepo:
                     "message": f"Config version_label '{version_label}' already exists for project '{project_id}'",
                 },
             )
-        row = ConfigVersion(project_id=project_id, version_label=version_label, json=json_data)
+        row = ConfigVersion(
+            project_id=project_id,
+            version_label=version_label,
+            json=json_data,
+            etag=_config_etag(json_data),
+        )
         self.db.add(row)
         await self.db.flush()
         await self.db.refresh(row)
         return row
 
+    async def ensure_etag(self, row: Union[ConfigVersion, ConfigSnapshot]) -> str:
+        """
+        Lazily backfill the etag for rows published before the column existed.
+        """
+        if row.etag is not None:
+            return row.etag
+        etag = _config_etag(row.json or {})
+        await self.db.execute(
+            update(ConfigVersion).where(ConfigVersion.id == row.id).values(etag=etag)
+        )
+        if isinstance(row, ConfigVersion):
+            set_committed_value(row, "etag", etag)
+        else:
+            # the cached snapshot is frozen; drop it so the next load sees the etag
+            _LATEST_CONFIG.pop(row.project_id)
+        return etag
+
     async def get_by_id(self, version_id: UUID) -> Optional[ConfigVersion]:
         res = await self.db.execute(select(ConfigVersion).where(ConfigVersion.id == version_id))
         return res.scalar_one_or_none()
@@ -54,7 +112,10 @@ class ConfigRepo:
         )
         return res.scalar_one_or_none()
 
-    async def get_latest(self, project_id: str) -> Optional[ConfigVersion]:
+    async def get_latest(self, project_id: str) -> Optional[ConfigSnapshot]:
+        cached = _LATEST_CONFIG.get(project_id)
+        if cached is not None:
+            return cached
         stmt = (
             select(ConfigVersion)
             .where(ConfigVersion.project_id == project_id)
@@ -62,7 +123,16 @@ class ConfigRepo:
             .limit(1)
         )
         res = await self.db.execute(stmt)
-        return res.scalar_one_or_none()
+        row = res.scalar_one_or_none()
+        if row is None:
+            return None
+        snap = ConfigSnapshot.from_row(row)
+        _LATEST_CONFIG.set(project_id, snap)
+        return snap
+
+    @staticmethod
+    def invalidate_latest(project_id: str) -> None:
+        _LATEST_CONFIG.pop(project_id)
 
     async def list_versions(self, project_id: str, limit: int = 20, offset: int = 0) -> List[ConfigVersion]:
         res = await self.db.execute(
@@ -89,20 +159,63 @@ class SubscriptionRepo:
         return row
 
     async def get(self, sub_id: UUID) -> Optional[Subscription]:
-        res = await self.db.execute(select(Subscription).where(Subscription.id == sub_id))
-        return res.scalar_one_or_none()
+        # primary-key fast path; served from the identity map if already loaded
+        return await self.db.get(Subscription, sub_id)
 
-    async def list_for_account(self, project_id: str, account_id: str) -> List[Subscription]:
+    async def get_for_project(self, sub_id: UUID, project_id: str) -> Optional[Subscription]:
         res = await self.db.execute(
+            select(Subscription).where(Subscription.id == sub_id, Subscription.project_id == project_id)
+        )
+        return res.scalar_one_or_none()
+
+    async def list_for_account(
+        self,
+        project_id: str,
+        account_id: str,
+        *,
+        limit: Optional[int] = None,
+        cursor: Optional[UUID] = None,
+    ) -> List[Subscription]:
+        """
+        Newest first. With `cursor` (id of the last row already seen), keyset-paginates
+        on (created_at, id) instead of OFFSET.
+        """
+        q = (
             select(Subscription)
             .where(
                 Subscription.project_id == project_id,
                 Subscription.account_id == account_id,
             )
-            .order_by(Subscription.created_at.desc())
+            .order_by(Subscription.created_at.desc(), Subscription.id.desc())
         )
+        if cursor is not None:
+            anchor = select(Subscription.created_at).where(Subscription.id == cursor).scalar_subquery()
+            q = q.where(tuple_(Subscription.created_at, Subscription.id) < tuple_(anchor, cursor))
+        if limit is not None:
+            q = q.limit(limit)
+        res = await self.db.execute(q)
         return list(res.scalars().all())
 
+    async def get_current_period(
+        self, project_id: str, account_id: str
+    ) -> Optional[Tuple[Optional[datetime], Optional[datetime]]]:
+        """
+        (current_period_start, current_period_end) of the newest active-like subscription,
+        else of the newest one at all; None when the account has none.
+        """
+        active_like = Subscription.status.in_(("trialing", "active", "past_due", "pending"))
+        res = await self.db.execute(
+            select(Subscription.current_period_start, Subscription.current_period_end)
+            .where(
+                Subscription.project_id == project_id,
+                Subscription.account_id == account_id,
+            )
+            .order_by(case((active_like, 0), else_=1), Subscription.created_at.desc())
+            .limit(1)
+        )
+        row = res.first()
+        return tuple(row) if row else None
+
     async def update(
         self,
         sub: Subscription,
@@ -195,36 +308,89 @@ class EventRepo:
         event_id: str,          # provider's event id (Stripe's 'id')
         project_id: str,        # must be non-null now (per SQL)
         event_type: str,
-        payload: dict,
+        payload: dict | bytes,
     ) -> bool:
         """
         Insert payment_event if not already recorded.
-        Dedupe by (provider, payload->>'id') for Stripe without needing an extra column.
+        Single INSERT ... ON CONFLICT (provider, event_id) DO NOTHING RETURNING id:
+        no row back means the event was already recorded.
+        Raw request bytes are cast to JSONB server-side instead of being re-serialized.
+        """
+        if isinstance(payload, (bytes, bytearray)):
+            payload = cast(literal(payload.decode("utf-8"), Text), JSONB)
+        stmt = (
+            pg_insert(PaymentEvent)
+            .values(
+                project_id=project_id,
+                provider=provider,
+                event_id=event_id,
+                event_type=event_type,
+                payload=payload,
+            )
+            .on_conflict_do_nothing(index_elements=["provider", "event_id"])
+            .returning(PaymentEvent.id)
+        )
+        res = await self.db.execute(stmt)
+        return res.scalar_one_or_none() is not None
+
+    async def lock_next_unprocessed(
+        self,
+        *,
+        provider: str,
+        received_before: datetime,
+        max_attempts: int,
+        exclude: Sequence[UUID] = (),
+    ) -> Optional[PaymentEvent]:
+        """
+        Oldest event that was never applied and is still under the attempt cap, locked
+        FOR UPDATE SKIP LOCKED: concurrent sweepers (one per worker) each get a different
+        event instead of queueing behind one another. The lock lasts until the caller's
+        transaction ends.
         """
-        # EXISTS ... WHERE provider = ? AND payload->>'id' = :event_id
-        exists_stmt = (
-            select(PaymentEvent.id)
+        q = (
+            select(PaymentEvent)
             .where(
                 PaymentEvent.provider == provider,
-                # payload->>'id' = :event_id   (works for json & jsonb)
-                PaymentEvent.payload.op("->>")("id") == event_id,
+                PaymentEvent.processed_at.is_(None),
+                PaymentEvent.received_at < received_before,
+                PaymentEvent.attempts < max_attempts,
             )
+            .order_by(PaymentEvent.received_at)
             .limit(1)
+            .with_for_update(skip_locked=True)
         )
-        res = await self.db.execute(exists_stmt)
-        if res.scalar_one_or_none():
-            return False
+        if exclude:
+            q = q.where(PaymentEvent.id.not_in(exclude))
+        res = await self.db.execute(q)
+        return res.scalar_one_or_none()
 
-        self.db.add(
-            PaymentEvent(
-                project_id=project_id,
-                provider=provider,
-                event_type=event_type,
-                payload=payload,
+    async def record_failure(self, *, provider: str, event_id: str, error: str) -> Optional[int]:
+        """Count a failed apply attempt; returns the new attempt count."""
+        res = await self.db.execute(
+            update(PaymentEvent)
+            .where(PaymentEvent.provider == provider, PaymentEvent.event_id == event_id)
+            .values(attempts=PaymentEvent.attempts + 1, last_error=error[:2000])
+            .returning(PaymentEvent.attempts)
+        )
+        return res.scalar_one_or_none()
+
+    async def claim_unprocessed(self, *, provider: str, event_id: str) -> bool:
+        """
+        Stamp processed_at if it is still NULL. The UPDATE holds the row lock until the
+        caller's transaction ends, so a concurrent claim waits and then sees it processed;
+        rolling back releases the event for another attempt.
+        """
+        res = await self.db.execute(
+            update(PaymentEvent)
+            .where(
+                PaymentEvent.provider == provider,
+                PaymentEvent.event_id == event_id,
+                PaymentEvent.processed_at.is_(None),
             )
+            .values(processed_at=func.now())
+            .returning(PaymentEvent.id)
         )
-        await self.db.flush()
-        return True
+        return res.scalar_one_or_none() is not None
 
 
 # -------------------- Invoices (mirror from Stripe) --------------------
@@ -327,15 +493,32 @@ class InvoiceRepo:
 
         await self.db.flush()
 
-    async def list_for_account(
-        self, *, project_id: str, account_id: str, limit: int = 50, offset: int = 0
-    ) -> List[Invoice]:
+    @staticmethod
+    def _account_query(*, project_id: str, account_id: str, limit: int, offset: int):
         sub_q = select(Subscription.stripe_subscription_id).where(
             Subscription.project_id == project_id,
             Subscription.account_id == account_id,
         )
-        q = (
+        return (
             select(Invoice)
+            # only the columns the list view renders
+            .options(
+                load_only(
+                    Invoice.id,
+                    Invoice.project_id,
+                    Invoice.stripe_invoice_id,
+                    Invoice.stripe_customer_id,
+                    Invoice.stripe_subscription_id,
+                    Invoice.status,
+                    Invoice.currency,
+                    Invoice.subtotal,
+                    Invoice.total,
+                    Invoice.hosted_invoice_url,
+                    Invoice.period_start,
+                    Invoice.period_end,
+                    Invoice.created_at,
+                )
+            )
             .where(
                 Invoice.project_id == project_id,
                 Invoice.stripe_subscription_id.in_(sub_q),
@@ -344,9 +527,25 @@ class InvoiceRepo:
             .offset(offset)
             .limit(limit)
         )
+
+    async def list_for_account(
+        self, *, project_id: str, account_id: str, limit: int = 50, offset: int = 0
+    ) -> List[Invoice]:
+        q = self._account_query(project_id=project_id, account_id=account_id, limit=limit, offset=offset)
         res = await self.db.execute(q)
         return list(res.scalars().all())
 
+    async def iter_for_account(
+        self, *, project_id: str, account_id: str, limit: int = 50, offset: int = 0
+    ) -> AsyncIterator[Invoice]:
+        """
+        Same rows as list_for_account, streamed from a server-side cursor.
+        """
+        q = self._account_query(project_id=project_id, account_id=account_id, limit=limit, offset=offset)
+        res = await self.db.stream_scalars(q.execution_options(yield_per=100))
+        async for row in res:
+            yield row
+
     async def get_by_id(self, invoice_id: UUID) -> Optional[Invoice]:
         res = await self.db.execute(select(Invoice).where(Invoice.id == invoice_id))
         return res.scalar_one_or_none()
@@ -361,16 +560,24 @@ class InvoiceRepo:
         return res.scalar_one_or_none()
 
     async def get_detail_with_lines(self, invoice_id: UUID) -> tuple[Optional[Invoice], List[InvoiceLine]]:
-        inv_res = await self.db.execute(select(Invoice).where(Invoice.id == invoice_id))
+        inv_res = await self.db.execute(
+            select(Invoice).where(Invoice.id == invoice_id).options(selectinload(Invoice.lines))
+        )
         invoice = inv_res.scalar_one_or_none()
         if not invoice:
             return None, []
-        lines_res = await self.db.execute(
-            select(InvoiceLine).where(InvoiceLine.invoice_id == invoice_id).order_by(InvoiceLine.id)
-        )
-        return invoice, list(lines_res.scalars().all())
+        return invoice, list(invoice.lines)
     
 # -------------------- Usage Records (metered billing) --------------------
+def _hour_floor(dt: datetime) -> datetime:
+    return dt.astimezone(timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def _hour_ceil(dt: datetime) -> datetime:
+    floor = _hour_floor(dt)
+    return floor if floor == dt else floor + timedelta(hours=1)
+
+
 class UsageRepo:
     def __init__(self, db: AsyncSession):
         self.db = db
@@ -415,6 +622,26 @@ class UsageRepo:
         self.db.add(row)
         await self.db.flush()
         await self.db.refresh(row)
+
+        # keep the hourly rollup in step; same transaction as the raw row
+        stmt = pg_insert(UsageRollupHour).values(
+            project_id=project_id,
+            account_id=account_id,
+            metric_key=metric_key,
+            bucket_hour=_hour_floor(row.occurred_at),
+            qty_sum=row.quantity,
+        )
+        await self.db.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[
+                    UsageRollupHour.project_id,
+                    UsageRollupHour.account_id,
+                    UsageRollupHour.metric_key,
+                    UsageRollupHour.bucket_hour,
+                ],
+                set_={"qty_sum": UsageRollupHour.qty_sum + stmt.excluded.qty_sum},
+            )
+        )
         return row
 
     async def summarize_window(
@@ -427,17 +654,44 @@ class UsageRepo:
     ) -> list[tuple[str, float]]:
         """
         Sum by metric_key in [start, end).
+        Whole hours come from usage_rollup_hour; raw events are only scanned for the
+        partial hours at either edge of the window.
         """
+        def raw(lo: datetime, hi: datetime):
+            return and_(UsageRecord.occurred_at >= lo, UsageRecord.occurred_at < hi)
+
+        first_full = _hour_ceil(start)
+        last_full = _hour_floor(end)
+
+        if first_full < last_full:
+            parts = [
+                select(UsageRollupHour.metric_key, UsageRollupHour.qty_sum.label("qty")).where(
+                    UsageRollupHour.project_id == project_id,
+                    UsageRollupHour.account_id == account_id,
+                    UsageRollupHour.bucket_hour >= first_full,
+                    UsageRollupHour.bucket_hour < last_full,
+                ),
+                select(UsageRecord.metric_key, UsageRecord.quantity.label("qty")).where(
+                    UsageRecord.project_id == project_id,
+                    UsageRecord.account_id == account_id,
+                    or_(raw(start, first_full), raw(last_full, end)),
+                ),
+            ]
+        else:
+            # window inside a single hour boundary: the raw scan is already small
+            parts = [
+                select(UsageRecord.metric_key, UsageRecord.quantity.label("qty")).where(
+                    UsageRecord.project_id == project_id,
+                    UsageRecord.account_id == account_id,
+                    raw(start, end),
+                )
+            ]
+
+        u = union_all(*parts).subquery()
         res = await self.db.execute(
-            select(UsageRecord.metric_key, func.coalesce(func.sum(UsageRecord.quantity), 0.0))
-            .where(
-                UsageRecord.project_id == project_id,
-                UsageRecord.account_id == account_id,
-                UsageRecord.occurred_at >= start,
-                UsageRecord.occurred_at < end,
-            )
-            .group_by(UsageRecord.metric_key)
-            .order_by(UsageRecord.metric_key)
+            select(u.c.metric_key, func.coalesce(func.sum(u.c.qty), 0.0))
+            .group_by(u.c.metric_key)
+            .order_by(u.c.metric_key)
         )
         return [(mk, float(total)) for mk, total in res.all()]
     
@@ -455,6 +709,49 @@ class IdempotencyRepo:
         )
         return res.scalar_one_or_none()
 
+    async def begin_or_get(self, *, project_id: str, key: str, request_hash: str) -> Tuple[IdempotencyKey, bool]:
+        """
+        Claim (project_id, key) with a single INSERT ... ON CONFLICT DO NOTHING.
+        Returns (row, True) when this call created the in-progress row, otherwise
+        (existing_row, False).
+        """
+        stmt = (
+            pg_insert(IdempotencyKey)
+            .values(
+                project_id=project_id,
+                key=key,
+                request_hash=request_hash,
+                status="in_progress",
+                response=None,
+            )
+            .on_conflict_do_nothing(index_elements=["project_id", "key"])
+            .returning(IdempotencyKey)
+        )
+        row = (await self.db.scalars(stmt)).one_or_none()
+        if row is not None:
+            return row, True
+        existing = await self.db.get(IdempotencyKey, (project_id, key))
+        return existing, False
+
+    async def reclaim_failed(self, *, project_id: str, key: str, request_hash: str) -> Optional[IdempotencyKey]:
+        """
+        Flip a failed key back to in-progress with one conditional UPDATE ... RETURNING.
+        A concurrent reclaim blocks on the row lock, then matches nothing, so exactly one
+        caller gets the row back; everyone else gets None.
+        """
+        stmt = (
+            update(IdempotencyKey)
+            .where(
+                IdempotencyKey.project_id == project_id,
+                IdempotencyKey.key == key,
+                IdempotencyKey.status == "failed",
+            )
+            .values(status="in_progress", request_hash=request_hash, response=None)
+            .returning(IdempotencyKey)
+            .execution_options(populate_existing=True)
+        )
+        return (await self.db.scalars(stmt)).one_or_none()
+
     async def create_in_progress(self, *, project_id: str, key: str, request_hash: str) -> IdempotencyKey:
         row = IdempotencyKey(
             project_id=project_id,
@@ -530,6 +827,10 @@ class EntitlementsRepo:
 
 # -------------------- Helpers --------------------
 
+def _config_etag(doc: dict) -> str:
+    # stable ETag of the inner JSON document (sorted keys, compact)
+    return hashlib.sha256(orjson.dumps(doc, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
 def _from_epoch(ts: Optional[int]) -> Optional[datetime]:
     if ts is None:
         return None
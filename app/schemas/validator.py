@@ -5,13 +5,7 @@ from pathlib import Path
 from fastapi import HTTPException
 from jsonschema import Draft202012Validator
 
-_schema_cache: Draft202012Validator | None = None
-
 def _load_schema() -> Draft202012Validator:
-    global _schema_cache
-    if _schema_cache is not None:
-        return _schema_cache
-
     # adjust the path if your schema lives elsewhere
     schema_path = Path(__file__).with_name("config_schema.json")
 
@@ -22,17 +16,19 @@ def _load_schema() -> Draft202012Validator:
         raise RuntimeError(f"Failed to load schema: {e}") from e
 
     try:
-        _schema_cache = Draft202012Validator(schema_dict)
-        return _schema_cache
+        Draft202012Validator.check_schema(schema_dict)
+        return Draft202012Validator(schema_dict)
     except Exception as e:
         raise RuntimeError(f"Invalid JSON schema: {e}") from e
 
+# Built once at import: a broken schema fails app startup instead of the first publish.
+_VALIDATOR = _load_schema()
+
 def validate_config_or_400(body: dict) -> None:
     """
     body is the request JSON (dict). Raises HTTP 400 on validation errors.
     """
-    validator = _load_schema()
-    errors = sorted(validator.iter_errors(body), key=lambda e: e.path)
+    errors = sorted(_VALIDATOR.iter_errors(body), key=lambda e: e.path)
     if errors:
         first = errors[0]
         loc = "/".join(str(p) for p in first.path) or "(root)"
@@ -43,4 +39,4 @@ def validate_config_or_400(body: dict) -> None:
                 "at": loc,
                 "message": first.message,
             },
-        )
\ No newline at end of file
+        )
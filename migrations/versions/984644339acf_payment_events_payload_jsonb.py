@@ -0,0 +1,39 @@
+"""payment_events.payload as JSONB
+
+Revision ID: 984644339acf
+Revises: ac76c06a6461
+Create Date: 2026-10-16 01:56:52.635367
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '984644339acf'
+down_revision: Union[str, Sequence[str], None] = 'ac76c06a6461'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.alter_column(
+        'payment_events', 'payload',
+        type_=postgresql.JSONB(astext_type=sa.Text()),
+        existing_nullable=False,
+        postgresql_using='payload::jsonb',
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.alter_column(
+        'payment_events', 'payload',
+        type_=sa.JSON(),
+        existing_nullable=False,
+        postgresql_using='payload::json',
+    )
@@ -0,0 +1,47 @@
+"""payment_events.event_id with unique (provider, event_id)
+
+Revision ID: ac76c06a6461
+Revises: fa07f85fd5b7
+Create Date: 2026-10-16 01:53:30.806624
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'ac76c06a6461'
+down_revision: Union[str, Sequence[str], None] = 'fa07f85fd5b7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('payment_events', sa.Column('event_id', sa.String(), nullable=True))
+    op.execute("UPDATE payment_events SET event_id = payload->>'id' WHERE event_id IS NULL")
+    # the old SELECT-then-INSERT dedupe could race, so duplicates may exist; keep the
+    # earliest delivery of each event
+    op.execute(
+        """
+        DELETE FROM payment_events pe
+        USING (
+            SELECT id, row_number() OVER (
+                PARTITION BY provider, event_id ORDER BY received_at, id
+            ) AS rn
+            FROM payment_events
+            WHERE event_id IS NOT NULL
+        ) dup
+        WHERE pe.id = dup.id AND dup.rn > 1
+        """
+    )
+    op.alter_column('payment_events', 'event_id', nullable=False)
+    op.create_unique_constraint('uq_payment_events_provider_event', 'payment_events', ['provider', 'event_id'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_constraint('uq_payment_events_provider_event', 'payment_events', type_='unique')
+    op.drop_column('payment_events', 'event_id')
@@ -0,0 +1,30 @@
+"""payment_events.processed_at
+
+Revision ID: b129a5469b07
+Revises: 984644339acf
+Create Date: 2026-10-16 02:01:39.450287
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b129a5469b07'
+down_revision: Union[str, Sequence[str], None] = '984644339acf'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('payment_events', sa.Column('processed_at', sa.TIMESTAMP(timezone=True), nullable=True))
+    # events recorded before this were applied inline
+    op.execute("UPDATE payment_events SET processed_at = received_at")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('payment_events', 'processed_at')
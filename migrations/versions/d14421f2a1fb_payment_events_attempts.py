@@ -0,0 +1,30 @@
+"""payment_events attempts and last_error
+
+Revision ID: d14421f2a1fb
+Revises: e2baf0b72243
+Create Date: 2026-10-16 02:40:07.772654
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd14421f2a1fb'
+down_revision: Union[str, Sequence[str], None] = 'e2baf0b72243'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('payment_events', sa.Column('attempts', sa.Integer(), server_default=sa.text('0'), nullable=False))
+    op.add_column('payment_events', sa.Column('last_error', sa.Text(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('payment_events', 'last_error')
+    op.drop_column('payment_events', 'attempts')
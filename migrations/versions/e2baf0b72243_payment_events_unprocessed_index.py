@@ -0,0 +1,33 @@
+"""payment_events unprocessed index
+
+Revision ID: e2baf0b72243
+Revises: e62e3d481173
+Create Date: 2026-10-16 02:29:45.069339
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e2baf0b72243'
+down_revision: Union[str, Sequence[str], None] = 'e62e3d481173'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index(
+        'ix_payment_events_unprocessed',
+        'payment_events',
+        ['received_at'],
+        postgresql_where=sa.text('processed_at IS NULL'),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_payment_events_unprocessed', table_name='payment_events')
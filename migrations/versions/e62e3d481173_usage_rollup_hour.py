@@ -0,0 +1,46 @@
+"""usage_rollup_hour
+
+Revision ID: e62e3d481173
+Revises: b129a5469b07
+Create Date: 2026-10-16 02:08:13.802667
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e62e3d481173'
+down_revision: Union[str, Sequence[str], None] = 'b129a5469b07'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('usage_rollup_hour',
+    sa.Column('project_id', sa.String(), nullable=False),
+    sa.Column('account_id', sa.String(), nullable=False),
+    sa.Column('metric_key', sa.String(), nullable=False),
+    sa.Column('bucket_hour', sa.TIMESTAMP(timezone=True), nullable=False),
+    sa.Column('qty_sum', sa.Numeric(precision=20, scale=6, asdecimal=True), nullable=False),
+    sa.PrimaryKeyConstraint('project_id', 'account_id', 'metric_key', 'bucket_hour')
+    )
+    op.create_index('ix_usage_rollup_window', 'usage_rollup_hour', ['project_id', 'account_id', 'bucket_hour'], unique=False)
+    # backfill from the raw events recorded so far
+    op.execute(
+        """
+        INSERT INTO usage_rollup_hour (project_id, account_id, metric_key, bucket_hour, qty_sum)
+        SELECT project_id, account_id, metric_key, date_trunc('hour', occurred_at, 'UTC'), SUM(quantity)
+        FROM usage_records
+        GROUP BY 1, 2, 3, 4
+        """
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_usage_rollup_window', table_name='usage_rollup_hour')
+    op.drop_table('usage_rollup_hour')
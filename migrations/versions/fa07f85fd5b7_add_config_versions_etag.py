@@ -0,0 +1,28 @@
+"""add config_versions.etag
+
+Revision ID: fa07f85fd5b7
+Revises: 4aeb2f7c6874
+Create Date: 2026-10-16 01:50:29.764427
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'fa07f85fd5b7'
+down_revision: Union[str, Sequence[str], None] = '4aeb2f7c6874'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('config_versions', sa.Column('etag', sa.CHAR(length=64), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('config_versions', 'etag')
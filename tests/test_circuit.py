@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+
+from app.core.circuit import CircuitBreaker, CircuitOpenError
+
+
+class Transient(Exception):
+    pass
+
+
+class NotFound(Exception):
+    pass
+
+
+def _half_open_breaker() -> CircuitBreaker:
+    breaker = CircuitBreaker("test", failure_threshold=1, recovery_timeout=0.0, trip_on=(Transient,))
+
+    async def trip():
+        with pytest.raises(Transient):
+            async with breaker:
+                raise Transient()
+
+    asyncio.run(trip())
+    assert breaker.state == CircuitBreaker.OPEN
+    return breaker
+
+
+def test_cancelled_probe_does_not_close_and_frees_the_slot():
+    breaker = _half_open_breaker()
+
+    async def scenario():
+        async def probe():
+            async with breaker:
+                await asyncio.sleep(10)
+
+        task = asyncio.create_task(probe())
+        await asyncio.sleep(0)
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        # a second caller is refused while the probe is in flight
+        with pytest.raises(CircuitOpenError):
+            async with breaker:
+                pass
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert breaker.state == CircuitBreaker.OPEN
+        # the next caller gets to probe
+        async with breaker:
+            assert breaker.state == CircuitBreaker.HALF_OPEN
+
+    asyncio.run(scenario())
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_cancellation_while_closed_keeps_failure_count():
+    breaker = CircuitBreaker("test", failure_threshold=2, trip_on=(Transient,))
+
+    async def scenario():
+        with pytest.raises(Transient):
+            async with breaker:
+                raise Transient()
+        with pytest.raises(asyncio.CancelledError):
+            async with breaker:
+                raise asyncio.CancelledError()
+        assert breaker.state == CircuitBreaker.CLOSED
+        with pytest.raises(Transient):
+            async with breaker:
+                raise Transient()
+
+    asyncio.run(scenario())
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_failed_probe_reopens():
+    breaker = _half_open_breaker()
+
+    async def scenario():
+        with pytest.raises(Transient):
+            async with breaker:
+                raise Transient()
+
+    asyncio.run(scenario())
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_non_tripping_answer_closes_half_open():
+    breaker = _half_open_breaker()
+
+    async def scenario():
+        with pytest.raises(NotFound):
+            async with breaker:
+                raise NotFound()
+
+    asyncio.run(scenario())
+    assert breaker.state == CircuitBreaker.CLOSED
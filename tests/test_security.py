@@ -0,0 +1,104 @@
+import time
+
+import jwt
+import pytest
+from fastapi import HTTPException
+
+from app.core import security
+from app.core.settings import settings
+
+
+def _token(payload, *, key=None, algorithm=None, headers=None):
+    return jwt.encode(
+        payload,
+        key or settings.JWT_SECRET,
+        algorithm=algorithm or settings.JWT_ALGORITHM,
+        headers=headers,
+    )
+
+
+def _claims(**extra):
+    now = int(time.time())
+    claims = {"sub": "u1", "iat": now, "exp": now + 600}
+    if settings.JWT_ISSUER:
+        claims["iss"] = settings.JWT_ISSUER
+    if settings.JWT_AUDIENCE:
+        claims["aud"] = settings.JWT_AUDIENCE
+    claims.update(extra)
+    return claims
+
+
+def _expected(token):
+    """What verify_jwt_token must do for this token, derived from jwt.decode itself."""
+    try:
+        return jwt.decode(token, **security._DECODE_KWARGS), None
+    except jwt.ExpiredSignatureError:
+        return None, "Token expired"
+    except jwt.InvalidTokenError as e:
+        return None, f"Invalid token: {e}"
+
+
+def _swap_payload(token, other):
+    header, _, signature = token.split(".")
+    return ".".join([header, other.split(".")[1], signature])
+
+
+_NOW = int(time.time())
+
+CASES = {
+    "valid": lambda: _token(_claims()),
+    "iat_not_numeric": lambda: _token(_claims(iat="yesterday")),
+    "iat_in_future": lambda: _token(_claims(iat=_NOW + 3600)),
+    "aud_empty_string": lambda: _token(_claims(aud="")),
+    "aud_list": lambda: _token(_claims(aud=["a", "b"])),
+    "exp_digit_string": lambda: _token(_claims(exp=str(_NOW + 600))),
+    "exp_not_numeric": lambda: _token(_claims(exp="soon")),
+    "exp_missing": lambda: _token({k: v for k, v in _claims().items() if k != "exp"}),
+    "expired": lambda: _token(_claims(exp=_NOW - 10)),
+    "nbf_malformed": lambda: _token(_claims(nbf="later")),
+    "nbf_in_future": lambda: _token(_claims(nbf=_NOW + 3600)),
+    "nbf_in_past": lambda: _token(_claims(nbf=_NOW - 10)),
+    "iss_mismatch": lambda: _token(_claims(iss="someone-else")),
+    "wrong_key": lambda: _token(_claims(), key="not-the-secret-but-long-enough-for-hmac"),
+    "wrong_alg": lambda: _token(_claims(), algorithm="HS512" if settings.JWT_ALGORITHM != "HS512" else "HS384"),
+    "tampered_payload": lambda: _swap_payload(_token(_claims()), _token(_claims(sub="u2"))),
+    "garbage": lambda: "not.a.jwt",
+    "two_segments": lambda: "abc.def",
+}
+
+
+@pytest.fixture(autouse=True)
+def _clear_cache():
+    security._VERIFIED.clear()
+    yield
+    security._VERIFIED.clear()
+
+
+@pytest.mark.parametrize("case", sorted(CASES))
+def test_verify_matches_jwt_decode(case):
+    token = CASES[case]()
+    payload, detail = _expected(token)
+    if detail is None:
+        assert security.verify_jwt_token(token) == payload
+    else:
+        with pytest.raises(HTTPException) as exc:
+            security.verify_jwt_token(token)
+        assert exc.value.status_code == 401
+        assert exc.value.detail == detail
+
+
+@pytest.mark.parametrize("case", ["valid", "exp_digit_string"])
+def test_cached_hit_matches_first_decode(case):
+    token = CASES[case]()
+    first = security.verify_jwt_token(token)
+    assert security.verify_jwt_token(token) == first
+
+
+def test_returned_claims_are_not_the_cached_dict():
+    token = CASES["valid"]()
+    first = security.verify_jwt_token(token)
+    first["sub"] = "mutated"
+    second = security.verify_jwt_token(token)
+    assert second["sub"] == "u1"
+    second["sub"] = "mutated-again"
+    assert security.verify_jwt_token(token)["sub"] == "u1"